@@ -0,0 +1,210 @@
+"""
+Benchmarks and regression checks of the protocol path.
+
+Covers the 7-bit packing (also timed against the original byte-by-byte
+loop, kept here as a fixed reference), building SysEx frames from the
+checkbox states and full write/read round trips against the emulator
+(loopback ports, no hardware needed). Results can be stored as a baseline; later runs fail
+(exit code 1) when a benchmark regresses by more than the threshold, or
+when a result is wrong: a broken codec must not pass as a speed-up.
+
+    python3 benchmark.py --save-baseline       # on a known good version
+    python3 benchmark.py                       # compare with the baseline
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from protocol import (
+    DEVICE, COMMAND_WRITE_TO_DEVICE, SysexClient,
+    build_message, convert_to_7bit_message, decode_routing, encode_routing, masks_from_states
+)
+import sysex7bit
+from emulator import EmulatedPort, EmulatedRack
+from port_pool import PortPool
+from routing_matrix import RoutingMatrix
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+CHECKBOX_STATES = [[(output + channel) % 3 == 0 for channel in range(17)] for output in range(8)]
+ENABLED_OUTPUTS = masks_from_states(CHECKBOX_STATES)
+
+
+class CorrectnessError(Exception):
+    """A benchmarked operation returned a wrong result."""
+
+
+def check(condition, what):
+    if not condition:
+        raise CorrectnessError(what)
+
+
+def measure_throughput(function, min_time=0.2, repeat=7):
+    """Best of repeat runs of function(), in calls per second."""
+    calls = 1
+    while True:                                 # find a number of calls lasting about min_time
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 4:
+            break
+        calls *= 4
+    calls = max(1, int(calls * min_time / elapsed))
+
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        best = max(best, calls / (time.perf_counter() - start))
+    return best
+
+
+def measure_latency(function, count=300, repeat=3):
+    """Best median duration of function() over repeat rounds of count calls, in microseconds."""
+    best = None
+    for _ in range(repeat):
+        durations = []
+        for _ in range(count):
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+        durations.sort()
+        median = durations[len(durations) // 2]
+        best = median if best is None else min(best, median)
+    return best * 1e6
+
+
+def check_codec():
+    """Check the packing and the frames before timing them."""
+    payload = bytes(ENABLED_OUTPUTS)
+    check(sysex7bit.pack(b"\x80" + bytes(6)) == b"\x40" + bytes(8), "pack: carry bit of the first byte")
+    check(sysex7bit.pack(b"\xff" * 7) == b"\x7f" * 8 + b"\x00", "pack: full group")
+    check(sysex7bit.pack(payload) == bytes(reference_pack(payload)), "pack: same bytes as the reference")
+    check(sysex7bit.unpack(sysex7bit.pack(payload)) == payload, "unpack(pack()) round trip")
+    packed_message = [0] * 20
+    convert_to_7bit_message(ENABLED_OUTPUTS, packed_message)
+    check(bytes(packed_message) == sysex7bit.pack(payload), "convert_to_7bit_message")
+    check(sysex7bit.pack_many([payload] * 4) == [sysex7bit.pack(payload)] * 4, "pack_many")
+    check(bytes(decode_routing(encode_routing(ENABLED_OUTPUTS))) == payload, "encode/decode_routing")
+    check(build_message(COMMAND_WRITE_TO_DEVICE, RoutingMatrix(ENABLED_OUTPUTS).encode(), DEVICE).data
+          == build_message(COMMAND_WRITE_TO_DEVICE, encode_routing(masks_from_states(CHECKBOX_STATES)), DEVICE).data,
+          "frame from the routing matrix and from the checkbox states")
+
+
+def reference_pack(byte_message):
+    """The original byte-by-byte packing, kept unchanged as a fixed reference for pack()."""
+    packed_message = [0] * sysex7bit.packed_size(len(byte_message))
+    carry, carry_idx, packed_idx, carry_cnt = 0x00, 0, 1, 0
+    for byte in byte_message:
+        packed_message[packed_idx] = byte & 0x7F
+        packed_idx += 1
+        carry |= (byte & 0x80) >> carry_cnt + 1
+        carry_cnt += 1
+        if carry_cnt == 7:
+            packed_message[carry_idx] = carry
+            carry, carry_cnt = 0x00, 0
+            carry_idx = packed_idx
+            packed_idx += 1
+    packed_message[carry_idx] = carry
+    return packed_message
+
+
+def frame_from_states():
+    build_message(COMMAND_WRITE_TO_DEVICE, encode_routing(masks_from_states(CHECKBOX_STATES)), DEVICE)
+
+
+def run_benchmarks():
+    """Return {name: (value, unit, higher_is_better)}."""
+    check_codec()
+    results = {}
+    payload = bytes(ENABLED_OUTPUTS)
+    packed = sysex7bit.pack(payload)
+    bank = [payload] * 1000
+    matrix = RoutingMatrix(ENABLED_OUTPUTS)
+
+    results["pack_17_bytes"] = (measure_throughput(lambda: sysex7bit.pack(payload)), "ops/s", True)
+    results["reference_pack_17_bytes"] = (measure_throughput(lambda: reference_pack(payload)), "ops/s", True)
+    results["pack_speedup_vs_reference"] = (
+        results["pack_17_bytes"][0] / results["reference_pack_17_bytes"][0], "x", True)
+    results["unpack_20_bytes"] = (measure_throughput(lambda: sysex7bit.unpack(packed)), "ops/s", True)
+    results["pack_many_1000"] = (measure_throughput(lambda: sysex7bit.pack_many(bank)), "ops/s", True)
+    results["frame_from_checkbox_states"] = (measure_throughput(frame_from_states), "ops/s", True)
+    results["frame_from_routing_matrix"] = (
+        measure_throughput(lambda: build_message(COMMAND_WRITE_TO_DEVICE, matrix.encode(), DEVICE)), "ops/s", True)
+
+    link = EmulatedPort([DEVICE])
+    rack = EmulatedRack({"bench": link})
+    port_pool = PortPool(rack.open_output, rack.open_input)
+    port_pool.select("bench", "bench")
+    client = SysexClient(port_pool, timeout=0.5, retries=0)
+    try:
+        results["write_round_trip"] = (
+            measure_latency(lambda: client.write_routing(ENABLED_OUTPUTS, DEVICE)), "us", False)
+        check(bytes(link.unit(DEVICE).enabled_outputs) == payload, "routing written to the emulated unit")
+        results["read_round_trip"] = (measure_latency(lambda: client.read_routing(DEVICE)), "us", False)
+        check(bytes(client.read_routing(DEVICE)) == payload, "routing read back from the emulated unit")
+    finally:
+        port_pool.close()
+        rack.close()
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the results against the baseline. Return the names of the regressed benchmarks."""
+    regressions = []
+    for name, (value, unit, higher_is_better) in results.items():
+        line = f"{name:30} {value:14.1f} {unit}"
+        if name in baseline:
+            reference = baseline[name]["value"]
+            change = (value - reference) / reference if reference else 0.0
+            worse = -change if higher_is_better else change
+            line += f"   baseline {reference:14.1f}  {change * 100:+6.1f} %"
+            if worse > threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MIDI 1-8 protocol benchmarks")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="relative regression considered as a failure (default: 0.5)")
+    args = parser.parse_args(argv)
+
+    try:
+        results = run_benchmarks()
+    except CorrectnessError as e:
+        print(f"wrong result: {e}")
+        return 1
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({name: {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+                       for name, (value, unit, higher_is_better) in results.items()}, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif not baseline:
+        print(f"no baseline in {args.baseline}, run with --save-baseline first")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
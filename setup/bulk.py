@@ -0,0 +1,231 @@
+"""
+Bulk SysEx transfers: large payloads (preset banks, per-output filters,
+firmware tables...) split into small numbered chunks, since many USB-MIDI
+interfaces choke on long SysEx messages.
+
+Frames (after the usual MANUFACTURER/MODEL/DEVICE header):
+
+    BULK_BEGIN  <transfer> <target> <size:3> <chunk size:2> <chunk count:2>
+                answered by BULK_BEGIN <transfer>
+    BULK_CHUNK  <transfer> <index:2> <7-bit packed chunk data>
+                answered by BULK_ACK <transfer> <index:2>
+    BULK_END    <transfer> <crc32:5>
+                answered by BULK_END <transfer> <status>   (BULK_OK, BULK_INCOMPLETE, BULK_BAD_CHECKSUM)
+
+(n = number of 7-bit bytes of an integer field, most significant first)
+
+Chunks are pipelined: up to a window of chunks are in flight, each one
+acknowledged on its own, and only chunks whose acknowledge is late are sent
+again. The window follows the measured round-trip time so that the link is
+kept busy (round-trip time / time to send one chunk at 31250 baud).
+"""
+import math
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import sysex7bit
+from protocol import (
+    DEVICE, COMMAND_BULK_BEGIN, COMMAND_BULK_CHUNK, COMMAND_BULK_ACK, COMMAND_BULK_END,
+    SysexClient, SysexError, SysexTimeout, build_message, encode_int7, decode_int7, is_reply
+)
+
+BULK_OK           = 0x00
+BULK_INCOMPLETE   = 0x01
+BULK_BAD_CHECKSUM = 0x02
+
+DEFAULT_CHUNK_SIZE = 48         # 48 bytes -> 56 packed bytes, 65 bytes with the SysEx header
+MAX_CHUNK_SIZE = (1 << 14) - 1  # 14 bit chunk size
+MAX_CHUNKS = 1 << 14            # 14 bit chunk index
+MAX_SIZE = (1 << 21) - 1        # 21 bit payload size
+BYTE_TIME = 10 / 31250          # seconds per byte on a MIDI DIN link
+MIN_RTO = 0.02                  # seconds
+
+_next_transfer_id = 0
+_transfer_id_lock = threading.Lock()
+
+
+class BulkError(SysexError):
+    """The device rejected a bulk transfer."""
+
+
+def crc_field(data):
+    """CRC-32 of the data as 5 7-bit bytes."""
+    return encode_int7(zlib.crc32(data), 5)
+
+
+def send_bulk(port_pool, data, target, device=DEVICE, chunk_size=DEFAULT_CHUNK_SIZE, max_window=32,
+              timeout=0.5, retries=5):
+    """
+    Send data to the device as a bulk transfer. Return a dict of statistics:
+    chunks, retransmits, rtt_ms, window, duration_s, bytes_per_s.
+    """
+    global _next_transfer_id
+
+    data = bytes(data)
+    if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"invalid chunk size: {chunk_size} (1 to {MAX_CHUNK_SIZE})")
+    if not 0 <= target <= 0x7F:
+        raise ValueError(f"invalid bulk target: {target} (0 to 127)")
+    if len(data) > MAX_SIZE:
+        raise ValueError(f"payload too large: {len(data)} bytes (max {MAX_SIZE})")
+    chunk_count = max(1, math.ceil(len(data) / chunk_size))
+    if chunk_count > MAX_CHUNKS:
+        raise ValueError(f"payload too large: {chunk_count} chunks of {chunk_size} bytes (max {MAX_CHUNKS})")
+
+    with _transfer_id_lock:                     # transfers can be started from several threads
+        transfer = _next_transfer_id
+        _next_transfer_id = (_next_transfer_id + 1) & 0x7F
+
+    # every chunk frame is built before the transfer starts
+    frames = [build_message(COMMAND_BULK_CHUNK,
+                            [transfer] + encode_int7(index, 2)
+                            + list(sysex7bit.pack(data[index * chunk_size:(index + 1) * chunk_size])),
+                            device)
+              for index in range(chunk_count)]
+    chunk_time = max(len(frame) for frame in frames) * BYTE_TIME
+
+    client = SysexClient(port_pool, timeout, retries)
+    start = time.perf_counter()
+    reply = client.request(COMMAND_BULK_BEGIN,
+                           [transfer, target] + encode_int7(len(data), 3)
+                           + encode_int7(chunk_size, 2) + encode_int7(chunk_count, 2),
+                           device)
+    if not reply or reply[0] != transfer:
+        raise BulkError(f"device {device:02X} answered BULK_BEGIN of another transfer")
+    srtt = time.perf_counter() - start          # first estimate of the round-trip time
+
+    condition = threading.Condition()
+    acked = bytearray(chunk_count)
+    sends = [0] * chunk_count
+    in_flight = OrderedDict()                   # index -> last send time, oldest first
+    state = {"srtt": srtt, "remaining": chunk_count}
+
+    def on_message(message):
+        if not is_reply(message, COMMAND_BULK_ACK, device) or len(message.data) < 7:
+            return
+        if message.data[4] != transfer:
+            return
+        index = decode_int7(message.data[5:7])
+        received_at = time.perf_counter()
+        with condition:
+            if index >= chunk_count or acked[index]:
+                return
+            acked[index] = 1
+            state["remaining"] -= 1
+            sent_at = in_flight.pop(index, None)
+            if sent_at is not None and sends[index] == 1:
+                # only chunks sent once give a meaningful sample (Karn's rule)
+                state["srtt"] += (received_at - sent_at - state["srtt"]) / 8
+            condition.notify()
+
+    retransmits = 0
+    next_chunk = 0
+    window = 1
+    port_pool.add_listener(on_message)
+    try:
+        while True:
+            with condition:
+                while True:
+                    if state["remaining"] == 0:
+                        break
+                    now = time.perf_counter()
+                    window = min(max_window, max(1, math.ceil(state["srtt"] / chunk_time) + 1))
+                    rto = min(timeout, max(MIN_RTO, 4 * state["srtt"]))
+
+                    # oldest unacknowledged chunk late? send it again, and only it
+                    if in_flight:
+                        index, sent_at = next(iter(in_flight.items()))
+                        if now - sent_at >= rto:
+                            if sends[index] > retries:
+                                raise SysexTimeout(f"bulk transfer: chunk {index} not acknowledged "
+                                                   f"after {sends[index]} attempts")
+                            retransmits += 1
+                            break
+                    if next_chunk < chunk_count and len(in_flight) < window:
+                        index = next_chunk
+                        next_chunk += 1
+                        break
+                    # nothing to send: wait for an acknowledge or the next timeout
+                    wait = rto - (now - next(iter(in_flight.values()))) if in_flight else rto
+                    condition.wait(max(wait, 0.001))
+
+                if state["remaining"] == 0:
+                    break
+                sends[index] += 1
+                in_flight[index] = time.perf_counter()
+                in_flight.move_to_end(index)
+
+            port_pool.send(frames[index])           # never send while holding the lock
+    finally:
+        port_pool.remove_listener(on_message)
+
+    reply = client.request(COMMAND_BULK_END, [transfer] + crc_field(data), device)
+    if not reply or reply[0] != transfer:
+        raise BulkError(f"device {device:02X} answered BULK_END of another transfer")
+    status = reply[1] if len(reply) >= 2 else BULK_INCOMPLETE
+    if status != BULK_OK:
+        raise BulkError(f"bulk transfer rejected by device {device:02X}: status {status:02X}")
+
+    duration = time.perf_counter() - start
+    return {
+        "chunks": chunk_count,
+        "retransmits": retransmits,
+        "rtt_ms": state["srtt"] * 1000,
+        "window": window,
+        "duration_s": duration,
+        "bytes_per_s": len(data) / duration if duration else 0.0,
+    }
+
+
+class BulkReceiver:
+    """Device side of a bulk transfer (used by the emulator). Completed payloads go to data[target]."""
+
+    def __init__(self):
+        self.transfers = {}
+        self.completed = set()          # finished transfers, to answer a BULK_END sent again (lost reply)
+        self.data = {}
+
+    def handle(self, command, payload):
+        """Return the reply payload of a bulk command, or None if it is not answered."""
+        if not payload:
+            return None
+        transfer = payload[0]
+
+        if command == COMMAND_BULK_BEGIN and len(payload) >= 9:
+            self.completed.discard(transfer)
+            self.transfers[transfer] = {
+                "target": payload[1],
+                "size": decode_int7(payload[2:5]),
+                "chunk_size": decode_int7(payload[5:7]),
+                "chunk_count": decode_int7(payload[7:9]),
+                "chunks": {},
+            }
+            return [transfer]
+
+        current = self.transfers.get(transfer)
+        if current is None:
+            if command == COMMAND_BULK_END and transfer in self.completed:
+                return [transfer, BULK_OK]
+            return None
+
+        if command == COMMAND_BULK_CHUNK and len(payload) >= 3:
+            index = decode_int7(payload[1:3])
+            if index < current["chunk_count"]:
+                current["chunks"][index] = sysex7bit.unpack(bytes(payload[3:]))
+                return [transfer] + encode_int7(index, 2)
+            return None
+
+        if command == COMMAND_BULK_END:
+            if len(current["chunks"]) != current["chunk_count"]:
+                return [transfer, BULK_INCOMPLETE]
+            data = b"".join(current["chunks"][index] for index in range(current["chunk_count"]))[:current["size"]]
+            if crc_field(data) != list(payload[1:6]):
+                return [transfer, BULK_BAD_CHECKSUM]
+            del self.transfers[transfer]
+            self.completed.add(transfer)
+            self.data[current["target"]] = data
+            return [transfer, BULK_OK]
+
+        return None
@@ -0,0 +1,437 @@
+"""
+Command line interface for the MIDI 1-8, for scripts and headless rack controllers.
+
+Shares the SysEx protocol with the GUI (protocol.py) but never imports Qt;
+mido and the MIDI backend are only loaded by the commands that need them.
+
+Exit codes:
+    0   success
+    1   the device did not answer or rejected the request (analyze: the routing chokes the bus,
+        split: a file could not be split)
+    2   invalid command line or routing file
+    3   MIDI port error
+"""
+import argparse
+import json
+import os
+import sys
+
+EXIT_OK         = 0
+EXIT_NO_ANSWER  = 1
+EXIT_USAGE      = 2
+EXIT_PORT_ERROR = 3
+
+
+def load_routing_file(file_name):
+    """
+    Read a routing file: a JSON list of 8 outputs, each a list of 17 booleans (or 0/1),
+    channels 1 to 16 then RT. Return the 17 channel masks.
+    """
+    from protocol import NBR_OUTPUTS, NBR_CHANNELS, masks_from_states
+
+    with open(file_name) as f:
+        checkbox_states = json.load(f)
+
+    if len(checkbox_states) != NBR_OUTPUTS or any(len(row) != NBR_CHANNELS for row in checkbox_states):
+        raise ValueError(f"{file_name}: expected {NBR_OUTPUTS} rows of {NBR_CHANNELS} values")
+    return masks_from_states(checkbox_states)
+
+
+def format_routing(enabled_outputs):
+    """Text grid of the routing, same layout as the GUI."""
+    from protocol import NBR_OUTPUTS, states_from_masks
+
+    lines = ["Channels: " + " ".join(f"{channel + 1:>2}" for channel in range(16)) + " RT"]
+    for output, row in enumerate(states_from_masks(enabled_outputs)):
+        lines.append(f"Output {output + 1}: " + " ".join(" x" if state else " ." for state in row))
+    return "\n".join(lines)
+
+
+def open_client(args):
+    from port_pool import PortPool
+    from protocol import SysexClient
+
+    if not args.output or not args.input:
+        raise ValueError("--output and --input are required (or MIDI18_OUTPUT / MIDI18_INPUT)")
+
+    port_pool = PortPool()
+    port_pool.select(args.output, args.input)
+    return SysexClient(port_pool, args.timeout, args.retries)
+
+
+def command_list(args):
+    from mido import get_output_names, get_input_names
+
+    print("Outputs:")
+    for name in get_output_names():
+        print(f"  {name}")
+    print("Inputs:")
+    for name in get_input_names():
+        print(f"  {name}")
+
+
+def command_ping(args):
+    client = open_client(args)
+    try:
+        client.ping(args.device)
+        print(f"device {args.device:02X}: ok")
+    finally:
+        client.port_pool.close()
+
+
+def command_read(args):
+    from protocol import states_from_masks
+
+    client = open_client(args)
+    try:
+        enabled_outputs = client.read_routing(args.device)
+    finally:
+        client.port_pool.close()
+
+    if args.json:
+        print(json.dumps([[int(state) for state in row] for row in states_from_masks(enabled_outputs)]))
+    else:
+        print(format_routing(enabled_outputs))
+
+
+def command_write(args):
+    enabled_outputs = load_routing_file(args.routing_file)
+
+    client = open_client(args)
+    try:
+        client.write_routing(enabled_outputs, args.device)
+        print(f"device {args.device:02X}: written")
+    finally:
+        client.port_pool.close()
+
+
+def command_recall(args):
+    from presets import PresetLibrary
+
+    library = PresetLibrary(args.library)
+    if args.preset not in library:
+        raise ValueError(f"no preset named {args.preset!r} in {args.library}")
+
+    client = open_client(args)
+    try:
+        client.exchange(library.frame(args.preset, args.device))
+        print(f"device {args.device:02X}: preset {args.preset} recalled")
+    finally:
+        client.port_pool.close()
+        library.close()
+
+
+def command_scenes(args):
+    import time
+    from presets import PresetLibrary
+    from scenes import SceneEngine, load_scene_map
+
+    library = PresetLibrary(args.library)
+    client = open_client(args)
+
+    def on_fired(scene, seconds):
+        print(f"{scene.trigger}: {scene.name} ({seconds * 1000:.3f} ms)")
+
+    engine = SceneEngine(client.port_pool, args.device, on_fired)
+    try:
+        for trigger, name in load_scene_map(args.scene_map).items():
+            engine.add_preset(trigger, library, name)
+        engine.arm()
+        print(f"{len(engine.scenes())} scene(s) armed on {args.input}, Ctrl+C to stop")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.disarm()
+        client.port_pool.close()
+        library.close()
+
+    stats = engine.stats()
+    if stats["fired"]:
+        print(f"{stats['fired']} scene(s) fired, trigger to send p50 {stats['p50_ms']:.3f} ms,"
+              f" p99 {stats['p99_ms']:.3f} ms, max {stats['max_ms']:.3f} ms")
+
+
+def command_route(args):
+    import time
+    from port_pool import PortPool
+    from router import SoftwareRouter, VIRTUAL_PORT_NAME, format_stats, open_outputs
+
+    if not args.input:
+        raise ValueError("--input is required (or MIDI18_INPUT)")
+    enabled_outputs = load_routing_file(args.routing_file)
+    names = [None if name == "-" else name for name in args.outputs]
+    if args.virtual and not names:
+        names = [VIRTUAL_PORT_NAME.format(output + 1) for output in range(8)]
+    if not any(names) or len(names) > 8:
+        raise ValueError("give 1 to 8 output ports (or --virtual)")
+
+    router = SoftwareRouter(open_outputs(names, virtual=args.virtual), enabled_outputs)
+    port_pool = PortPool()
+    port_pool.select(input_name=args.input)
+    try:
+        port_pool.add_listener(router.on_message)
+        port_pool.listen()
+        print(f"routing {args.input} to {', '.join(name for name in names if name)}, Ctrl+C to stop")
+        while True:
+            time.sleep(args.stats_interval or 1)
+            if args.stats_interval:
+                print(format_stats(router))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        port_pool.close()
+        router.close()
+    print(format_stats(router))
+
+
+def command_bulk_send(args):
+    from bulk import send_bulk
+
+    with open(args.data_file, "rb") as f:
+        data = f.read()
+
+    client = open_client(args)
+    try:
+        client.port_pool.listen()
+        result = send_bulk(client.port_pool, data, args.target, args.device, args.chunk_size,
+                           timeout=args.timeout, retries=max(args.retries, 1))
+    finally:
+        client.port_pool.close()
+
+    print(f"{len(data)} bytes in {result['chunks']} chunks, {result['retransmits']} retransmitted,"
+          f" {result['duration_s']:.2f} s ({result['bytes_per_s']:.0f} B/s, rtt {result['rtt_ms']:.1f} ms,"
+          f" window {result['window']})")
+
+
+def command_discover(args):
+    from fleet import Fleet
+
+    fleet = Fleet([(args.output, args.input)], timeout=args.timeout, retries=args.retries)
+    try:
+        units = fleet.discover()
+    finally:
+        fleet.close()
+
+    for unit in units:
+        print(f"device {unit.device:02X}")
+    if not units:
+        return EXIT_NO_ANSWER
+
+
+def command_scan(args):
+    import discovery
+
+    pairs = discovery.scan(total_time=args.time)
+    best = discovery.best_pairs(pairs)
+    for pair in pairs:
+        mark = "*" if best[pair.device] is pair else " "
+        print(f"{mark} device {pair.device:02X}: {pair.output} -> {pair.input}, {pair.rtt * 1000:.1f} ms")
+    if not pairs:
+        return EXIT_NO_ANSWER
+
+
+def command_ping_storm(args):
+    from instrumentation import ping_storm
+
+    client = open_client(args)
+    try:
+        result = ping_storm(client.port_pool, args.device, args.count, args.rate, args.timeout)
+    finally:
+        client.port_pool.close()
+
+    print(f"sent {result['sent']}, received {result['received']}, loss {result['loss'] * 100:.1f} %")
+    if result["received"]:
+        print(f"rtt p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, max {result['max_ms']:.2f} ms")
+    if args.export:
+        client.port_pool.instrumentation.export(args.export)
+    if result["received"] < result["sent"]:
+        return EXIT_NO_ANSWER
+
+
+def command_analyze(args):
+    import load_analyzer
+
+    if not args.window > 0:
+        raise ValueError("--window must be positive")
+    enabled_outputs = load_routing_file(args.routing_file)
+    choked = False
+    for report in load_analyzer.analyze(args.paths, enabled_outputs, args.window, args.clock, args.jobs):
+        print(load_analyzer.format_report(report, args.max_delay))
+        if "error" in report or load_analyzer.chokes(report, args.max_delay):
+            choked = True
+    if choked:
+        return EXIT_NO_ANSWER
+
+
+def command_split(args):
+    import time
+    import splitter
+
+    enabled_outputs = load_routing_file(args.routing_file)
+    if not splitter.streaming_available():
+        print("note: this mido version has no track reader, whole files are loaded in memory", file=sys.stderr)
+    start = time.perf_counter()
+    reports = []
+    for report in splitter.split(args.paths, enabled_outputs, args.out_dir, args.jobs):
+        reports.append(report)
+        if "error" in report:
+            print(f"[{len(reports)}] {report['file']}: ERROR {report['error']}")
+        else:
+            print(f"[{len(reports)}] {report['file']}: {report['messages']} messages,"
+                  f" per output {' '.join(str(count) for count in report['outputs'])}")
+    print(splitter.format_summary(reports, time.perf_counter() - start))
+    if any("error" in report for report in reports):
+        return EXIT_NO_ANSWER
+
+
+def command_assign_id(args):
+    client = open_client(args)
+    try:
+        client.change_device_id(args.device, args.new_device)
+        print(f"device {args.device:02X} is now {args.new_device:02X}")
+    finally:
+        client.port_pool.close()
+
+
+def command_fleet_push(args):
+    """
+    The fleet file is a JSON list of units:
+        [{"output": ..., "input": ..., "device": 1, "routing": "file.json"}, ...]
+    """
+    from fleet import Fleet, Unit, print_results
+
+    with open(args.fleet_file) as f:
+        entries = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(args.fleet_file))
+    routings = {}
+    for entry in entries:
+        unit = Unit(entry["output"], entry["input"], int(entry["device"]))
+        routings[unit] = load_routing_file(os.path.join(base_dir, entry["routing"]))
+
+    fleet = Fleet({(unit.output, unit.input) for unit in routings}, timeout=args.timeout, retries=args.retries)
+    try:
+        results = fleet.push(routings)
+    finally:
+        fleet.close()
+
+    print_results(results)
+    if not all(result.ok for result in results):
+        return EXIT_NO_ANSWER
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="cli.py", description="MIDI 1-8 setup, command line version")
+    parser.add_argument("--output", default=os.environ.get("MIDI18_OUTPUT"), help="MIDI output port name")
+    parser.add_argument("--input", default=os.environ.get("MIDI18_INPUT"), help="MIDI input port name")
+    parser.add_argument("--device", type=lambda value: int(value, 0), default=0x01,
+                        help="device ID (default: 1)")
+    parser.add_argument("--timeout", type=float, default=0.5, help="reply timeout in seconds (default: 0.5)")
+    parser.add_argument("--retries", type=int, default=2, help="retries on timeout (default: 2)")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="list MIDI ports").set_defaults(function=command_list)
+    commands.add_parser("ping", help="ping the device").set_defaults(function=command_ping)
+
+    read_parser = commands.add_parser("read", help="read the routing from the device")
+    read_parser.add_argument("--json", action="store_true", help="print a routing file instead of a grid")
+    read_parser.set_defaults(function=command_read)
+
+    write_parser = commands.add_parser("write", help="write a routing file to the device")
+    write_parser.add_argument("routing_file")
+    write_parser.set_defaults(function=command_write)
+
+    recall_parser = commands.add_parser("recall", help="send a preset of a preset library to the device")
+    recall_parser.add_argument("library", help="preset library file (see presets.py)")
+    recall_parser.add_argument("preset")
+    recall_parser.set_defaults(function=command_recall)
+
+    scenes_parser = commands.add_parser("scenes", help="recall presets on Program Change / note triggers")
+    scenes_parser.add_argument("library", help="preset library file (see presets.py)")
+    scenes_parser.add_argument("scene_map", help='JSON object of trigger -> preset, e.g. {"program:1:5": "Verse"}')
+    scenes_parser.set_defaults(function=command_scenes)
+
+    route_parser = commands.add_parser("route", help="route --input to output ports like a unit would (software router)")
+    route_parser.add_argument("routing_file")
+    route_parser.add_argument("outputs", nargs="*", help="up to 8 output ports, outputs 1 to 8 (- = not connected)")
+    route_parser.add_argument("--virtual", action="store_true",
+                              help='create the output ports (default names: "MIDI 1-8 out 1"...)')
+    route_parser.add_argument("--stats-interval", type=float, default=0,
+                              help="print the per-output statistics every N seconds")
+    route_parser.set_defaults(function=command_route)
+
+    bulk_parser = commands.add_parser("bulk-send", help="send a file to the device as a bulk transfer")
+    bulk_parser.add_argument("target", type=lambda value: int(value, 0), help="what the data is (0 to 127)")
+    bulk_parser.add_argument("data_file")
+    bulk_parser.add_argument("--chunk-size", type=int, default=48, help="bytes per chunk (default: 48)")
+    bulk_parser.set_defaults(function=command_bulk_send)
+
+    commands.add_parser("discover", help="list the device IDs answering on the ports").set_defaults(
+        function=command_discover)
+
+    scan_parser = commands.add_parser("scan", help="find the port pairs reaching each device (* = fastest)")
+    scan_parser.add_argument("--time", type=float, default=1.0, help="total scan time in seconds (default: 1)")
+    scan_parser.set_defaults(function=command_scan)
+
+    storm_parser = commands.add_parser("ping-storm", help="fire pings at a fixed rate, report RTT and loss")
+    storm_parser.add_argument("--count", type=int, default=100, help="number of pings (default: 100)")
+    storm_parser.add_argument("--rate", type=float, default=50.0, help="pings per second (default: 50)")
+    storm_parser.add_argument("--export", help="save the link statistics (.json or .csv)")
+    storm_parser.set_defaults(function=command_ping_storm)
+
+    analyze_parser = commands.add_parser("analyze", help="estimate the bus load of MIDI files through a routing")
+    analyze_parser.add_argument("routing_file")
+    analyze_parser.add_argument("paths", nargs="+", help="MIDI files or directories")
+    analyze_parser.add_argument("--window", type=float, default=0.1, help="sliding window in seconds (default: 0.1)")
+    analyze_parser.add_argument("--clock", action="store_true", dest="clock", default=None,
+                                help="add MIDI clock (default: when the RT column is routed)")
+    analyze_parser.add_argument("--no-clock", action="store_false", dest="clock", default=None,
+                                help="do not add MIDI clock")
+    analyze_parser.add_argument("--max-delay", type=float, default=10.0,
+                                help="added latency (ms) considered as choking (default: 10)")
+    analyze_parser.add_argument("--jobs", type=int, help="parallel processes (default: one per core)")
+    analyze_parser.set_defaults(function=command_analyze)
+
+    split_parser = commands.add_parser("split", help="render MIDI files into one file per output, through a routing")
+    split_parser.add_argument("routing_file")
+    split_parser.add_argument("paths", nargs="+", help="MIDI files or directories")
+    split_parser.add_argument("--out-dir", default=".", help="where to write the split files (default: .)")
+    split_parser.add_argument("--jobs", type=int, help="parallel processes (default: one per core)")
+    split_parser.set_defaults(function=command_split)
+
+    assign_parser = commands.add_parser("assign-id", help="change the ID of --device")
+    assign_parser.add_argument("new_device", type=lambda value: int(value, 0))
+    assign_parser.set_defaults(function=command_assign_id)
+
+    fleet_parser = commands.add_parser("fleet-push", help="write many units in parallel")
+    fleet_parser.add_argument("fleet_file")
+    fleet_parser.set_defaults(function=command_fleet_push)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from protocol import SysexError
+
+    try:
+        return args.function(args) or EXIT_OK
+    except SysexError as e:
+        # no answer, or the device rejected the request
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_NO_ANSWER
+    except (ValueError, KeyError, FileNotFoundError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    except (OSError, RuntimeError, ImportError) as e:
+        # unknown or unavailable port, backend failure or missing backend
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_PORT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
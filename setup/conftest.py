@@ -0,0 +1,40 @@
+"""Fixtures of the emulator-backed tests: loopback links with emulated units, and clients on them."""
+import pytest
+
+from emulator import EmulatedPort, EmulatedRack
+from port_pool import PortPool
+from protocol import DEVICE, SysexClient
+
+
+@pytest.fixture
+def rack():
+    rack = EmulatedRack()
+    yield rack
+    rack.close()
+
+
+@pytest.fixture
+def connect(rack):
+    """connect(name, timeout, retries): a SysexClient on the link of the rack with that name."""
+    port_pools = []
+
+    def connect(name, timeout=0.05, retries=2):
+        port_pool = PortPool(rack.open_output, rack.open_input)
+        port_pool.select(name, name)
+        port_pools.append(port_pool)
+        return SysexClient(port_pool, timeout, retries)
+
+    yield connect
+    for port_pool in port_pools:
+        port_pool.close()
+
+
+@pytest.fixture
+def link(rack):
+    """A link named "link" with one unit on DEVICE."""
+    return rack.add("link", EmulatedPort([DEVICE]))
+
+
+@pytest.fixture
+def client(link, connect):
+    return connect("link")
@@ -0,0 +1,103 @@
+"""
+Cache of the last confirmed routing of every device, per port and device ID.
+
+Writes are compared with the cached state: nothing is sent when the routing
+did not change, and only the changed channels are sent (COMMAND_WRITE_CHANNELS)
+when that is shorter than the full frame. This keeps configuration traffic
+low on a 31250 baud bus that may carry live performance data at the same time.
+
+A partial write that is not acknowledged (firmware without
+COMMAND_WRITE_CHANNELS) falls back to the full frame. force=True always sends
+the full frame, for a unit that may have been reset or swapped since its
+state was cached.
+"""
+import json
+import os
+import threading
+
+from protocol import ROUTING_PACKED_SIZE, SysexTimeout, encode_channels
+
+WRITE_SKIPPED = "skipped"
+WRITE_PARTIAL = "partial"
+WRITE_FULL    = "full"
+
+
+class DeviceStateCache:
+    """Last routing confirmed by each device, persisted in a JSON file."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._states = {}
+        try:
+            with open(file_name) as f:
+                self._states = json.load(f)
+        except (OSError, ValueError):
+            pass                                # no cache yet, or unreadable: start from scratch
+
+    @staticmethod
+    def _key(port_name, device):
+        return f"{port_name}|{device}"
+
+    def get(self, port_name, device):
+        """Return the cached 17 channel masks, or None if the device state is unknown."""
+        with self._lock:
+            return self._states.get(self._key(port_name, device))
+
+    def set(self, port_name, device, enabled_outputs):
+        """Record a state confirmed by the device and save the cache."""
+        with self._lock:
+            self._states[self._key(port_name, device)] = list(enabled_outputs)
+            self._save()
+
+    def forget(self, port_name, device):
+        with self._lock:
+            if self._states.pop(self._key(port_name, device), None) is not None:
+                self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self.file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_name = self.file_name + ".tmp"
+        with open(temp_name, "w") as f:
+            json.dump(self._states, f)
+        os.replace(temp_name, self.file_name)   # never leave a half written cache
+
+
+def changed_channels(cached_outputs, enabled_outputs):
+    """Return {channel: enabled outputs} for every channel differing from the cached state."""
+    return {channel: enabled for channel, (cached, enabled) in enumerate(zip(cached_outputs, enabled_outputs))
+            if cached != enabled}
+
+
+def push_routing(client, cache, device, enabled_outputs, force=False):
+    """
+    Write the routing to the device, sending as little as possible (unless force).
+    Return WRITE_SKIPPED, WRITE_PARTIAL or WRITE_FULL.
+    """
+    port_name = client.port_pool.output_name
+    cached_outputs = None if force else cache.get(port_name, device)
+
+    changes = None
+    if cached_outputs is not None:
+        changes = changed_channels(cached_outputs, enabled_outputs)
+        if not changes:
+            return WRITE_SKIPPED
+        if len(encode_channels(changes)) >= ROUTING_PACKED_SIZE:
+            changes = None                      # the full frame is shorter
+
+    try:
+        if changes:
+            try:
+                client.write_channels(changes, device)
+            except SysexTimeout:
+                changes = None                  # partial writes not supported: send the full frame
+        if not changes:
+            client.write_routing(enabled_outputs, device)
+    except Exception:
+        cache.forget(port_name, device)         # the device may have applied it or not
+        raise
+
+    cache.set(port_name, device, enabled_outputs)
+    return WRITE_PARTIAL if changes else WRITE_FULL
@@ -0,0 +1,127 @@
+"""
+Port pair discovery.
+
+A broadcast COMMAND_PING_DEVICE is sent on every output at once, each one
+carrying its own token, while every input is listened to. A reply tells
+which input carries the answers of which output, for which device, and the
+round-trip time. Every port is opened on its own thread and the whole scan
+is bounded by a deadline, so a hung port cannot stall the search.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from protocol import MANUFACTURER, MODEL, DEVICE_BROADCAST, COMMAND_PING_DEVICE, build_sysex
+
+# a working port pair for a device, rtt in seconds
+PortPair = namedtuple("PortPair", "output input device rtt")
+
+
+def _token(index):
+    return [(index >> 7) & 0x7F, index & 0x7F]
+
+
+def scan(output_names=None, input_names=None, open_output=None, open_input=None, total_time=1.0):
+    """
+    Ping on every output and listen on every input for total_time seconds.
+    Return every PortPair found, lowest rtt first.
+    """
+    if output_names is None or input_names is None or open_output is None or open_input is None:
+        import mido
+        output_names = mido.get_output_names() if output_names is None else output_names
+        input_names = mido.get_input_names() if input_names is None else input_names
+        open_output = open_output or mido.open_output
+        open_input = open_input or mido.open_input
+
+    deadline = time.perf_counter() + total_time
+    lock = threading.Lock()
+    sent_at = {}                        # output index -> send time
+    replies = []                        # (input name, device, output index, receive time)
+    opened_ports = []
+    finished = threading.Event()
+
+    def keep(port):
+        # a port opened after the deadline by a slow backend is closed right away
+        with lock:
+            if not finished.is_set():
+                opened_ports.append(port)
+                return True
+        port.close()
+        return False
+
+    def listener(input_name):
+        def on_message(message):
+            received_at = time.perf_counter()
+            data = message.data if message.type == 'sysex' else ()
+            if (len(data) >= 6 and data[0] == MANUFACTURER and data[1] == MODEL
+                    and data[2] != DEVICE_BROADCAST and data[3] == COMMAND_PING_DEVICE):
+                with lock:
+                    replies.append((input_name, data[2], (data[4] << 7) | data[5], received_at))
+        return on_message
+
+    def open_and_listen(input_name):
+        try:
+            port = open_input(input_name, callback=listener(input_name))
+        except Exception as e:
+            print(f"scan: cannot open input {input_name}: {e}")
+            return
+        keep(port)
+
+    def open_and_ping(index, output_name):
+        from mido import Message
+
+        try:
+            port = open_output(output_name)
+        except Exception as e:
+            print(f"scan: cannot open output {output_name}: {e}")
+            return
+        if not keep(port):
+            return
+        sysex_message = build_sysex(COMMAND_PING_DEVICE, _token(index), DEVICE_BROADCAST)
+        with lock:
+            sent_at[index] = time.perf_counter()
+        try:
+            port.send(Message('sysex', data=sysex_message[1:-1]))
+        except Exception as e:
+            print(f"scan: cannot send on {output_name}: {e}")
+
+    # inputs first, so that the fastest replies are not missed
+    input_threads = [threading.Thread(target=open_and_listen, args=(name,), daemon=True) for name in input_names]
+    for thread in input_threads:
+        thread.start()
+    for thread in input_threads:
+        thread.join(max(0.0, deadline - time.perf_counter()) / 2)
+
+    for index, output_name in enumerate(output_names):
+        threading.Thread(target=open_and_ping, args=(index, output_name), daemon=True).start()
+
+    time.sleep(max(0.0, deadline - time.perf_counter()))
+
+    with lock:
+        finished.set()
+        ports = list(opened_ports)
+        found = {}
+        for input_name, device, index, received_at in replies:
+            if index not in sent_at or index >= len(output_names):
+                continue
+            pair = PortPair(output_names[index], input_name, device, received_at - sent_at[index])
+            key = (pair.output, pair.input, pair.device)
+            if key not in found or pair.rtt < found[key].rtt:
+                found[key] = pair
+
+    for port in ports:
+        try:
+            port.close()
+        except Exception:
+            pass
+
+    return sorted(found.values(), key=lambda pair: pair.rtt)
+
+
+def best_pairs(pairs):
+    """Keep the lowest latency port pair of each device: {device ID: PortPair}."""
+    best = {}
+    for pair in pairs:
+        if pair.device not in best or pair.rtt < best[pair.device].rtt:
+            best[pair.device] = pair
+    return best
@@ -0,0 +1,290 @@
+"""
+Software emulator of MIDI 1-8 units, for tests without hardware.
+
+An EmulatedPort is one MIDI link (interface) with one or more units chained
+on it. The units implement the SysEx protocol of protocol.py (ping, read,
+write, partial write, change ID, bulk transfers, with the same 7-bit
+packing) and route the other messages like the firmware: channel messages
+to the outputs of their channel, system messages to the outputs of the RT
+column.
+
+Replies can be delayed (latency + random jitter) and dropped (drop_rate),
+so the GUI, CLI and fleet code can be stress-tested with hundreds of units.
+
+The host side reaches the units either through in-process loopback ports
+(EmulatedRack.open_output / open_input, to be given to PortPool, Fleet or
+discovery.scan) or through virtual rtmidi ports (EmulatedPort.open_virtual).
+
+    python3 emulator.py --units 4          # virtual ports "MIDI 1-8 emulator"
+"""
+import heapq
+import random
+import threading
+import time
+
+from protocol import (
+    MANUFACTURER, MODEL, DEVICE, DEVICE_BROADCAST, NBR_OUTPUTS,
+    COMMAND_PING_DEVICE, COMMAND_READ_FROM_DEVICE, COMMAND_WRITE_TO_DEVICE,
+    COMMAND_CHANGE_DEVICE_ID, COMMAND_WRITE_CHANNELS,
+    COMMAND_BULK_BEGIN, COMMAND_BULK_CHUNK, COMMAND_BULK_ACK, COMMAND_BULK_END,
+    build_message, encode_routing, decode_routing, decode_channels
+)
+from routing_matrix import FIRMWARE_DEFAULT_ROUTING, output_mask
+from bulk import BulkReceiver
+
+
+class EmulatedDevice:
+    """One MIDI 1-8 unit: device ID, routing and per-output message counters."""
+
+    def __init__(self, device=DEVICE, enabled_outputs=FIRMWARE_DEFAULT_ROUTING):
+        self.device = device
+        self.enabled_outputs = bytearray(enabled_outputs)
+        self.output_counts = [0] * NBR_OUTPUTS
+        self.on_output = None               # optional on_output(device, output index, message)
+        self.bulk = BulkReceiver()          # bulk transfers, completed payloads in bulk.data[target]
+
+    def handle_sysex(self, data):
+        """Handle a SysEx addressed to this model. Return (reply command, reply payload), or None if no reply."""
+        device, command, payload = data[2], data[3], list(data[4:])
+        if device != self.device and not (device == DEVICE_BROADCAST and command == COMMAND_PING_DEVICE):
+            return None
+
+        if command in (COMMAND_BULK_BEGIN, COMMAND_BULK_CHUNK, COMMAND_BULK_END):
+            reply = self.bulk.handle(command, payload)
+            if reply is None:
+                return None
+            return (COMMAND_BULK_ACK if command == COMMAND_BULK_CHUNK else command), reply
+
+        reply = self._handle_command(command, payload)
+        return None if reply is None else (command, reply)
+
+    def _handle_command(self, command, payload):
+        if command == COMMAND_PING_DEVICE:
+            return payload                                      # echo the token, if any
+        if command == COMMAND_READ_FROM_DEVICE:
+            return encode_routing(self.enabled_outputs)
+        if command == COMMAND_WRITE_TO_DEVICE:
+            self.enabled_outputs[:] = bytes(decode_routing(payload))
+            return []
+        if command == COMMAND_WRITE_CHANNELS:
+            for channel, enabled in decode_channels(payload).items():
+                self.enabled_outputs[channel] = enabled
+            return []
+        if command == COMMAND_CHANGE_DEVICE_ID:
+            if payload and payload[0] < DEVICE_BROADCAST:
+                self.device = payload[0]
+                return []
+        return None
+
+    def route(self, status, message):
+        """Send a MIDI message to its outputs (counted, and given to on_output if set)."""
+        mask = output_mask(status, self.enabled_outputs)
+        for output in range(NBR_OUTPUTS):
+            if mask & (1 << output):
+                self.output_counts[output] += 1
+                if self.on_output is not None:
+                    self.on_output(self.device, output, message)
+
+
+class EmulatedPort:
+    """A MIDI link with units chained on it (every unit sees every message, like a MIDI thru chain)."""
+
+    def __init__(self, devices=(DEVICE,), latency=0.0, jitter=0.0, drop_rate=0.0, seed=None):
+        self.units = [device if isinstance(device, EmulatedDevice) else EmulatedDevice(device)
+                      for device in devices]
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self._callbacks = []                # host input callbacks
+        self._queue = []                    # (due time, sequence, message) of delayed replies
+        self._sequence = 0
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+        self._virtual_ports = []
+
+        self.received = 0
+        self.replied = 0
+        self.dropped = 0
+
+    def unit(self, device):
+        return next(unit for unit in self.units if unit.device == device)
+
+    # ---- host -> units ----
+
+    def receive(self, message):
+        """A message sent by the host on this link."""
+        self.received += 1
+        if message.type == 'sysex':
+            data = message.data
+            if len(data) >= 4 and data[0] == MANUFACTURER and data[1] == MODEL:
+                for unit in self.units:
+                    reply = unit.handle_sysex(data)
+                    if reply is not None:
+                        self._reply(build_message(reply[0], reply[1], unit.device))
+                return
+
+        status = message.bytes()[0]
+        for unit in self.units:
+            unit.route(status, message)
+
+    # ---- units -> host ----
+
+    def _reply(self, message):
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            self.dropped += 1
+            return
+
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay <= 0:
+            self._deliver(message)
+            return
+
+        with self._lock:
+            self._sequence += 1
+            heapq.heappush(self._queue, (time.perf_counter() + delay, self._sequence, message))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+
+    def _run(self):
+        # single scheduler thread for every delayed reply of this link
+        with self._lock:
+            while not self._closed:
+                if not self._queue:
+                    self._wakeup.wait()
+                    continue
+                due = self._queue[0][0] - time.perf_counter()
+                if due > 0:
+                    self._wakeup.wait(due)
+                    continue
+                message = heapq.heappop(self._queue)[2]
+                self._lock.release()
+                try:
+                    self._deliver(message)
+                finally:
+                    self._lock.acquire()
+
+    def _deliver(self, message):
+        self.replied += 1
+        for callback in list(self._callbacks):
+            callback(message)
+
+    # ---- virtual rtmidi ports ----
+
+    def open_virtual(self, name="MIDI 1-8 emulator"):
+        """
+        Expose this link as virtual rtmidi ports named name (host output -> units,
+        units -> host input). Return False if virtual ports are not available.
+        """
+        try:
+            import mido
+            to_host = mido.open_output(name, virtual=True)
+            from_host = mido.open_input(name, virtual=True, callback=self.receive)
+        except Exception as e:
+            print(f"virtual ports not available ({e}), use the loopback ports instead")
+            return False
+        self._virtual_ports += [to_host, from_host]
+        self._callbacks.append(to_host.send)
+        return True
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        for port in self._virtual_ports:
+            port.close()
+
+
+class LoopbackOutput:
+    """Host output port delivering to an EmulatedPort (same interface as a mido output)."""
+
+    def __init__(self, name, link):
+        self.name = name
+        self.link = link
+        self.closed = False
+
+    def send(self, message):
+        if self.closed:
+            raise IOError(f"port {self.name} is closed")
+        self.link.receive(message)
+
+    def close(self):
+        self.closed = True
+
+
+class LoopbackInput:
+    """Host input port receiving the replies of an EmulatedPort, through a callback."""
+
+    def __init__(self, name, link, callback=None):
+        self.name = name
+        self.link = link
+        self.closed = False
+        self.callback = callback
+        link._callbacks.append(self._receive)
+
+    def _receive(self, message):
+        if self.callback is not None:
+            self.callback(message)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.link._callbacks.remove(self._receive)
+
+
+class EmulatedRack:
+    """Named EmulatedPorts, with mido-like openers for PortPool, Fleet and discovery.scan."""
+
+    def __init__(self, links=None):
+        self.links = dict(links or {})
+
+    def add(self, name, link):
+        self.links[name] = link
+        return link
+
+    def output_names(self):
+        return sorted(self.links)
+
+    def input_names(self):
+        return sorted(self.links)
+
+    def open_output(self, name):
+        if name not in self.links:
+            raise IOError(f"unknown port: {name}")
+        return LoopbackOutput(name, self.links[name])
+
+    def open_input(self, name, callback=None):
+        if name not in self.links:
+            raise IOError(f"unknown port: {name}")
+        return LoopbackInput(name, self.links[name], callback)
+
+    def close(self):
+        for link in self.links.values():
+            link.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MIDI 1-8 emulator on virtual MIDI ports")
+    parser.add_argument("--name", default="MIDI 1-8 emulator", help="virtual port name")
+    parser.add_argument("--units", type=int, default=1, help="number of chained units, IDs from 1")
+    parser.add_argument("--latency", type=float, default=0.0, help="reply latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, in seconds")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="ratio of replies dropped")
+    args = parser.parse_args()
+
+    link = EmulatedPort(range(1, args.units + 1), args.latency, args.jitter, args.drop_rate)
+    if not link.open_virtual(args.name):
+        raise SystemExit(1)
+    print(f"{args.units} unit(s) on virtual port {args.name!r}, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        link.close()
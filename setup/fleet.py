@@ -0,0 +1,243 @@
+"""
+Fleet configuration: several MIDI 1-8 units, chained on several interfaces.
+
+Units are addressed by (port, device ID). Each physical output port is
+opened once and gets a single worker thread, even when it is paired with
+several inputs, so DEVICE-addressed messages sharing a port are serialized,
+while the ports themselves are driven concurrently.
+"""
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from port_pool import PortPool
+from protocol import DEVICE_BROADCAST, SysexClient
+
+# one unit of the rack: output/input port names + device ID
+Unit = namedtuple("Unit", "output input device")
+
+# outcome of an operation on one unit, latency in seconds
+UnitResult = namedtuple("UnitResult", "unit ok latency error")
+
+
+class Fleet:
+    """Discover, renumber and configure every unit reachable through a list of (output, input) port pairs."""
+
+    def __init__(self, port_pairs, open_output=None, open_input=None, timeout=0.5, retries=2):
+        self._open_output = open_output
+        self._outputs = {}                  # output name -> open port, shared by every pair of that output
+        self._outputs_lock = threading.Lock()
+
+        self.clients = {}
+        for output_name, input_name in sorted(set(port_pairs)):
+            port_pool = PortPool(self._open_shared_output, open_input)
+            port_pool.select(output_name, input_name)
+            self.clients[(output_name, input_name)] = SysexClient(port_pool, timeout, retries)
+
+    def _open_shared_output(self, name):
+        with self._outputs_lock:
+            port = self._outputs.get(name)
+            if port is None or port.closed:
+                if self._open_output is None:
+                    from mido import open_output
+                    self._open_output = open_output
+                port = self._outputs[name] = self._open_output(name)
+            return port
+
+    def close(self):
+        for client in self.clients.values():
+            client.port_pool.close()
+        with self._outputs_lock:
+            for port in self._outputs.values():
+                port.close()
+            self._outputs = {}
+
+    def _run_per_port(self, jobs, stop_on_failure=False):
+        """
+        jobs: {(output, input): [(unit, function(client, unit)), ...]}
+        Run the jobs of each output port sequentially (whatever their input), all
+        the output ports in parallel. stop_on_failure: after a failed job, the
+        next ones of that output are not run and fail as "not attempted".
+        Return the list of UnitResult, in job order for each port.
+        """
+        per_output = {}
+        for port_pair, port_jobs in jobs.items():
+            per_output.setdefault(port_pair[0], []).extend(
+                (self.clients[port_pair], unit, function) for unit, function in port_jobs)
+
+        def run_port(output_jobs):
+            results = []
+            failed = False
+            for client, unit, function in output_jobs:
+                if failed and stop_on_failure:
+                    results.append(UnitResult(unit, False, 0.0, "not attempted, an earlier step on this port failed"))
+                    continue
+                start = time.perf_counter()
+                try:
+                    function(client, unit)
+                except Exception as e:
+                    failed = True
+                    results.append(UnitResult(unit, False, time.perf_counter() - start, str(e)))
+                else:
+                    results.append(UnitResult(unit, True, time.perf_counter() - start, None))
+            return results
+
+        results = []
+        if not per_output:
+            return results
+        with ThreadPoolExecutor(max_workers=len(per_output)) as executor:
+            futures = [executor.submit(run_port, output_jobs) for output_jobs in per_output.values()]
+            for future in futures:
+                results += future.result()
+        return results
+
+    def discover(self, window=None, attempts=3):
+        """
+        Ping every port pair with a broadcast ping, attempts times (replies can be
+        lost on large chains), merging the replies. Return the list of Unit found.
+        """
+        def discover_output(port_pairs):
+            units = []
+            for port_pair in port_pairs:
+                devices = set()
+                try:
+                    for _ in range(attempts):
+                        devices.update(self.clients[port_pair].discover(window))
+                except Exception as e:
+                    print(f"discovery failed on {port_pair[0]}: {e}")
+                units += [Unit(port_pair[0], port_pair[1], device) for device in sorted(devices)]
+            return units
+
+        per_output = {}
+        for port_pair in self.clients:
+            per_output.setdefault(port_pair[0], []).append(port_pair)
+
+        units = []
+        if not per_output:
+            return units
+        with ThreadPoolExecutor(max_workers=len(per_output)) as executor:
+            for output_units in executor.map(discover_output, list(per_output.values())):
+                units += output_units
+        return units
+
+    def assign_ids(self, renumbering, in_use=None):
+        """
+        renumbering: {Unit: new device ID}. in_use: {output name: IDs answering on
+        that output}, discovered if not given. A renumbering onto an ID still used
+        on the same output (by a unit left alone, or targeted twice) fails without
+        being sent. The others are sent in an order that never puts two units on
+        the same ID, going through a free temporary ID to break cycles (1 -> 2,
+        2 -> 1). The steps of an output stop at the first failed one, since the
+        next ones rely on it. Return one UnitResult per unit.
+        """
+        if in_use is None:
+            in_use = {}
+            for unit in self.discover():
+                in_use.setdefault(unit.output, set()).add(unit.device)
+
+        rejected = {}
+        jobs = {}
+        unit_steps = {}                     # unit -> its (current ID, new ID) steps, in order
+        per_output = {}
+        for unit, new_device in renumbering.items():
+            per_output.setdefault(unit.output, {})[unit] = new_device
+        for output_name, moves in per_output.items():
+            steps = _plan_renumbering(moves, set(in_use.get(output_name, ())), rejected)
+            for unit, device, new_device in steps:
+                unit_steps.setdefault(unit, []).append((device, new_device))
+                jobs.setdefault((unit.output, unit.input), []).append(
+                    (unit, lambda client, unit, device=device, new_device=new_device:
+                        client.change_device_id(device, new_device))
+                )
+
+        # a unit moved through a temporary ID has two steps: merge them into one result
+        merged = {}
+        step_count = {}
+        for result in self._run_per_port(jobs, stop_on_failure=True):
+            step = step_count.get(result.unit, 0)
+            step_count[result.unit] = step + 1
+            previous = merged.get(result.unit)
+            if previous is None:
+                merged[result.unit] = result
+            elif previous.ok:
+                error = result.error
+                if not result.ok:
+                    error += f", left on temporary device ID {unit_steps[result.unit][step][0]:02X}"
+                merged[result.unit] = UnitResult(result.unit, result.ok, previous.latency + result.latency, error)
+        results = []
+        for unit in renumbering:
+            if unit in rejected:
+                results.append(UnitResult(unit, False, 0.0, rejected[unit]))
+            elif unit in merged:
+                results.append(merged[unit])
+            else:
+                results.append(UnitResult(unit, True, 0.0, None))     # already has that ID
+        return results
+
+    def push(self, routings):
+        """routings: {Unit: 17 channel masks}. Write every unit and return the list of UnitResult."""
+        jobs = {}
+        for unit, enabled_outputs in routings.items():
+            jobs.setdefault((unit.output, unit.input), []).append(
+                (unit, lambda client, unit, enabled_outputs=enabled_outputs:
+                    client.write_routing(enabled_outputs, unit.device))
+            )
+        return self._run_per_port(jobs)
+
+
+def _plan_renumbering(moves, in_use, rejected):
+    """
+    Order the renumberings {Unit: new ID} of one output, knowing the IDs in use
+    on it. Conflicting units go to rejected {Unit: reason}. Return the steps
+    [(unit, current ID, new ID)], each one onto an ID free at that point.
+    """
+    in_use |= {unit.device for unit in moves}
+    moves = {unit: new_device for unit, new_device in moves.items() if new_device != unit.device}
+
+    # reject until stable: a rejected unit keeps its ID, which may conflict with another move
+    while True:
+        targets = {}
+        for unit, new_device in moves.items():
+            targets.setdefault(new_device, []).append(unit)
+        vacated = {unit.device for unit in moves}
+        conflicts = {}
+        for new_device, units in targets.items():
+            if len(units) > 1:
+                for unit in units:
+                    conflicts[unit] = f"device ID {new_device:02X} requested for {len(units)} units"
+            elif new_device in in_use and new_device not in vacated:
+                conflicts[units[0]] = f"device ID {new_device:02X} already in use"
+        if not conflicts:
+            break
+        rejected.update(conflicts)
+        moves = {unit: new_device for unit, new_device in moves.items() if unit not in conflicts}
+
+    steps = []
+    current = {unit: unit.device for unit in moves}
+    occupied = set(in_use)
+    pending = dict(moves)
+    while pending:
+        ready = [unit for unit, new_device in pending.items() if new_device not in occupied]
+        if not ready:
+            # only cycles left: park one unit on a free ID, the rest of its cycle can then move
+            unit = next(iter(pending))
+            spare = next(device for device in range(DEVICE_BROADCAST)
+                         if device not in occupied and device not in pending.values())
+            steps.append((unit, current[unit], spare))
+            occupied.discard(current[unit])
+            occupied.add(spare)
+            current[unit] = spare
+            continue
+        for unit in ready:
+            steps.append((unit, current[unit], pending.pop(unit)))
+            occupied.discard(current[unit])
+            occupied.add(steps[-1][2])
+    return steps
+
+
+def print_results(results):
+    """Print a per-unit report of a fleet operation."""
+    for result in results:
+        status = "ok" if result.ok else f"FAILED ({result.error})"
+        print(f"{result.unit.output} / device {result.unit.device:02X}: {status} in {result.latency * 1000:.1f} ms")
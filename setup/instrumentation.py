@@ -0,0 +1,226 @@
+"""
+Latency and throughput instrumentation of the SysEx link.
+
+LinkStats records the time spent in each phase of an exchange (frame build,
+port open, send, reply wait), keeps rolling round-trip latencies per device,
+counts messages and bytes, and exports everything as JSON or CSV.
+
+ping_storm() fires pings at a given rate and reports RTT percentiles and
+loss, to spot bad interfaces or cabling in soak tests.
+"""
+import csv
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# latency histogram bucket upper bounds, in milliseconds
+HISTOGRAM_BOUNDS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, float("inf"))
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of values (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LinkStats:
+    """Thread-safe counters and rolling latency windows for one link (port pair)."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.phases = {}                # phase name -> [count, total seconds, max seconds]
+            self.latencies = {}             # device ID -> deque of rtt seconds
+            self.counters = {"messages_sent": 0, "bytes_sent": 0,
+                             "messages_received": 0, "bytes_received": 0, "timeouts": 0}
+            self.started_at = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as one occurrence of a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - start)
+
+    def record_phase(self, name, seconds):
+        with self._lock:
+            phase = self.phases.setdefault(name, [0, 0.0, 0.0])
+            phase[0] += 1
+            phase[1] += seconds
+            phase[2] = max(phase[2], seconds)
+
+    def record_latency(self, device, seconds):
+        with self._lock:
+            self.latencies.setdefault(device, deque(maxlen=self.window)).append(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_sent(self, size):
+        with self._lock:
+            self.counters["messages_sent"] += 1
+            self.counters["bytes_sent"] += size
+
+    def count_received(self, size):
+        with self._lock:
+            self.counters["messages_received"] += 1
+            self.counters["bytes_received"] += size
+
+    def histogram(self, device):
+        """Number of latencies per bucket of HISTOGRAM_BOUNDS_MS."""
+        with self._lock:
+            latencies = list(self.latencies.get(device, ()))
+        counts = [0] * len(HISTOGRAM_BOUNDS_MS)
+        for seconds in latencies:
+            for bucket, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+                if seconds * 1000 <= bound:
+                    counts[bucket] += 1
+                    break
+        return counts
+
+    def to_dict(self):
+        with self._lock:
+            elapsed = max(time.time() - self.started_at, 1e-9)
+            counters = dict(self.counters)
+            phases = {name: {"count": count, "total_ms": total * 1000, "max_ms": maximum * 1000,
+                             "mean_ms": total * 1000 / count if count else None}
+                      for name, (count, total, maximum) in self.phases.items()}
+            latencies = {device: list(values) for device, values in self.latencies.items()}
+
+        devices = {}
+        for device, values in latencies.items():
+            devices[f"{device:02X}"] = {
+                "count": len(values),
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": max(values) * 1000,
+                "histogram": dict(zip((str(bound) for bound in HISTOGRAM_BOUNDS_MS), self.histogram(device))),
+            }
+
+        counters["bytes_sent_per_s"] = counters["bytes_sent"] / elapsed
+        counters["bytes_received_per_s"] = counters["bytes_received"] / elapsed
+        return {"elapsed_s": elapsed, "counters": counters, "phases": phases, "devices": devices}
+
+    def export_json(self, file_name):
+        with open(file_name, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def export_csv(self, file_name):
+        """One row per measure: section, name, field, value."""
+        data = self.to_dict()
+        with open(file_name, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["section", "name", "field", "value"])
+            for name, value in data["counters"].items():
+                writer.writerow(["counter", name, "value", value])
+            for name, fields in data["phases"].items():
+                for field, value in fields.items():
+                    writer.writerow(["phase", name, field, value])
+            for device, fields in data["devices"].items():
+                for field, value in fields.items():
+                    if field == "histogram":
+                        for bound, count in value.items():
+                            writer.writerow(["histogram", device, f"<={bound}ms", count])
+                    else:
+                        writer.writerow(["device", device, field, value])
+
+    def export(self, file_name):
+        """Export as CSV if file_name ends with .csv, JSON otherwise."""
+        if file_name.lower().endswith(".csv"):
+            self.export_csv(file_name)
+        else:
+            self.export_json(file_name)
+
+    def summary(self):
+        data = self.to_dict()
+        lines = [", ".join(f"{name}: {value:.0f}" for name, value in data["counters"].items())]
+        for name, fields in data["phases"].items():
+            lines.append(f"{name}: {fields['count']} x {fields['mean_ms']:.2f} ms (max {fields['max_ms']:.2f} ms)")
+        for device, fields in data["devices"].items():
+            lines.append(f"device {device}: rtt p50 {fields['p50_ms']:.2f} ms, p99 {fields['p99_ms']:.2f} ms")
+        return "\n".join(lines)
+
+
+def ping_storm(port_pool, device, count=100, rate=50.0, timeout=0.5):
+    """
+    Send count pings at rate pings/s on an open port pool, each one carrying a
+    sequence number echoed by the device. Pings are not waited for one by one,
+    so the link is measured under load; a reply arriving more than timeout
+    seconds after its ping counts as lost. Return a dict with sent, received,
+    loss ratio and p50/p99/max RTT in milliseconds.
+    """
+    from mido import Message
+    from protocol import COMMAND_PING_DEVICE, MANUFACTURER, MODEL, build_sysex
+
+    if not 0 < count <= 1 << 14:
+        raise ValueError("1 to 16384 pings per storm (14 bit sequence numbers)")
+    if not rate > 0:
+        raise ValueError("the ping rate must be positive")
+
+    stats = port_pool.instrumentation
+    sent_at = [None] * count
+    rtts = []
+    lock = threading.Lock()
+    all_received = threading.Event()
+
+    def on_message(message):
+        received_at = time.perf_counter()
+        data = message.data if message.type == 'sysex' else ()
+        if (len(data) >= 6 and data[0] == MANUFACTURER and data[1] == MODEL
+                and data[2] == device and data[3] == COMMAND_PING_DEVICE):
+            sequence = (data[4] << 7) | data[5]
+            with lock:
+                if sequence < count and sent_at[sequence] is not None:
+                    rtt = received_at - sent_at[sequence]
+                    sent_at[sequence] = None            # count duplicates once
+                    if rtt > timeout:
+                        return                          # too late: lost
+                    rtts.append(rtt)
+                    stats.record_latency(device, rtt)
+                    if len(rtts) == count:
+                        all_received.set()
+
+    # frames are built before the storm, so that only sending is timed
+    messages = [Message('sysex', data=build_sysex(COMMAND_PING_DEVICE,
+                                                  [(sequence >> 7) & 0x7F, sequence & 0x7F], device)[1:-1])
+                for sequence in range(count)]
+
+    port_pool.listen()
+    port_pool.add_listener(on_message)
+    try:
+        interval = 1.0 / rate
+        next_send = time.perf_counter()
+        for sequence, message in enumerate(messages):
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with lock:
+                sent_at[sequence] = time.perf_counter()
+            port_pool.send(message)
+            next_send += interval
+        all_received.wait(timeout)
+    finally:
+        port_pool.remove_listener(on_message)
+
+    with lock:
+        received = list(rtts)
+    stats.count("timeouts", count - len(received))
+    return {
+        "sent": count,
+        "received": len(received),
+        "loss": (count - len(received)) / count if count else 0.0,
+        "p50_ms": percentile(received, 0.50) * 1000 if received else None,
+        "p99_ms": percentile(received, 0.99) * 1000 if received else None,
+        "max_ms": max(received) * 1000 if received else None,
+    }
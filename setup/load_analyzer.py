@@ -0,0 +1,194 @@
+"""
+Routing load analyzer: will a routing choke the 31250 baud MIDI bus?
+
+A MIDI file is played (as fast as possible, using its own timing) through a
+routing matrix, the way the firmware handles it: every routed message is
+written once on the single UART, with its outputs enabled, and the firmware
+waits for the transmit buffer to be empty (Serial.flush()) before reading the
+next message. Messages routed nowhere cost nothing.
+
+For each output the message and byte rates are measured over a sliding
+window; for the UART, the peak utilization over the same window and the
+queueing delay added to each message. MIDI clock (24 per quarter note,
+following the tempo of the file) is added when the RT column is routed,
+as a sequencer playing the file would send it.
+
+Directories are analyzed in parallel, one file per process.
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from protocol import NBR_OUTPUTS
+from routing_matrix import RT_CHANNEL, output_mask
+
+BAUD_RATE      = 31250
+BYTES_PER_S    = BAUD_RATE / 10             # 8 data bits + start + stop
+BYTE_TIME      = 1.0 / BYTES_PER_S          # 320 us
+CLOCKS_PER_BEAT = 24
+MIDI_FILE_EXTENSIONS = (".mid", ".midi", ".smf")
+
+
+class SlidingWindow:
+    """Sum of values over the last window seconds, with its peak."""
+
+    def __init__(self, window):
+        self.window = window
+        self.events = deque()
+        self.total = 0
+        self.peak = 0
+
+    def add(self, time, value):
+        self.events.append((time, value))
+        self.total += value
+        while self.events[0][0] <= time - self.window:
+            self.total -= self.events.popleft()[1]
+        if self.total > self.peak:
+            self.peak = self.total
+
+
+def _messages_with_clock(midi_file, clock):
+    """Yield (time in seconds, message) from a MidiFile, inserting MIDI clocks if requested."""
+    from mido import Message
+
+    clock_message = Message('clock')
+    now = 0.0
+    tempo = 500000                      # us per quarter note, MIDI default (120 bpm)
+    next_clock = 0.0
+    for message in midi_file:           # merged tracks, delta times in seconds
+        now += message.time
+        if clock:
+            while next_clock <= now:
+                yield next_clock, clock_message
+                next_clock += tempo / 1e6 / CLOCKS_PER_BEAT
+        if message.is_meta:
+            if message.type == 'set_tempo':
+                tempo = message.tempo
+            continue
+        yield now, message
+
+
+def analyze_file(file_name, enabled_outputs, window=0.1, clock=None):
+    """
+    Analyze one MIDI file through the 17 channel masks. clock: add MIDI clock
+    (default: when the RT column is routed). Return a dict report.
+    """
+    from mido import MidiFile
+
+    if not window > 0:
+        raise ValueError(f"invalid window: {window} s, must be positive")
+    enabled_outputs = bytes(enabled_outputs)
+    if clock is None:
+        clock = enabled_outputs[RT_CHANNEL] != 0
+
+    message_windows = [SlidingWindow(window) for _ in range(NBR_OUTPUTS)]
+    byte_windows = [SlidingWindow(window) for _ in range(NBR_OUTPUTS)]
+    output_messages = [0] * NBR_OUTPUTS
+    output_bytes = [0] * NBR_OUTPUTS
+    wire_window = SlidingWindow(window)
+
+    busy_until = 0.0                    # the UART is busy until then
+    delays = []
+    wire_bytes = 0
+    messages = 0
+    end = 0.0
+
+    for now, message in _messages_with_clock(MidiFile(file_name), clock):
+        messages += 1
+        end = now
+        data = message.bytes()
+        mask = output_mask(data[0], enabled_outputs)
+        if not mask:
+            continue
+
+        size = len(data)
+        start = max(now, busy_until)
+        delays.append(start - now)
+        busy_until = start + size * BYTE_TIME
+        wire_bytes += size
+        wire_window.add(now, size)
+
+        for output in range(NBR_OUTPUTS):
+            if mask & (1 << output):
+                output_messages[output] += 1
+                output_bytes[output] += size
+                message_windows[output].add(now, 1)
+                byte_windows[output].add(now, size)
+
+    delays.sort()
+    duration = max(end, 1e-9)
+    return {
+        "file": file_name,
+        "duration_s": end,
+        "messages": messages,
+        "clock": clock,
+        "outputs": [{
+            "messages": output_messages[output],
+            "bytes": output_bytes[output],
+            "peak_messages_per_s": message_windows[output].peak / window,
+            "peak_bytes_per_s": byte_windows[output].peak / window,
+        } for output in range(NBR_OUTPUTS)],
+        "wire": {
+            "bytes": wire_bytes,
+            "mean_utilization": wire_bytes / BYTES_PER_S / duration,
+            "peak_utilization": wire_window.peak / BYTES_PER_S / window,
+            "max_delay_ms": delays[-1] * 1000 if delays else 0.0,
+            "p99_delay_ms": delays[min(len(delays) - 1, int(0.99 * len(delays)))] * 1000 if delays else 0.0,
+        },
+    }
+
+
+def _analyze_file_safe(job):
+    file_name, enabled_outputs, window, clock = job
+    try:
+        return analyze_file(file_name, enabled_outputs, window, clock)
+    except Exception as e:
+        return {"file": file_name, "error": str(e)}
+
+
+def midi_files(paths):
+    """Expand directories (recursively) into the MIDI files they contain."""
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, file_names in sorted(os.walk(path)):
+                for file_name in sorted(file_names):
+                    if file_name.lower().endswith(MIDI_FILE_EXTENSIONS):
+                        yield os.path.join(directory, file_name)
+        else:
+            yield path
+
+
+def analyze(paths, enabled_outputs, window=0.1, clock=None, jobs=None):
+    """Analyze files and directories, in parallel. Yield one report per file, in order."""
+    if not window > 0:
+        raise ValueError(f"invalid window: {window} s, must be positive")
+    job_list = [(file_name, bytes(enabled_outputs), window, clock) for file_name in midi_files(paths)]
+    if len(job_list) <= 1 or jobs == 1:
+        yield from map(_analyze_file_safe, job_list)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(_analyze_file_safe, job_list, chunksize=4)
+
+
+def chokes(report, max_delay_ms=10.0):
+    """True if the bus is saturated or adds more than max_delay_ms to a message."""
+    wire = report["wire"]
+    return wire["peak_utilization"] >= 1.0 or wire["max_delay_ms"] > max_delay_ms
+
+
+def format_report(report, max_delay_ms=10.0):
+    """Text report of one file, flagging a routing that would choke the bus."""
+    if "error" in report:
+        return f"{report['file']}: ERROR {report['error']}"
+
+    wire = report["wire"]
+    lines = [f"{report['file']}: {report['messages']} messages in {report['duration_s']:.1f} s"
+             + (" (with clock)" if report["clock"] else ""),
+             f"  wire: peak {wire['peak_utilization'] * 100:.0f} %, mean {wire['mean_utilization'] * 100:.1f} %,"
+             f" added latency p99 {wire['p99_delay_ms']:.2f} ms, max {wire['max_delay_ms']:.2f} ms"
+             + ("  << CHOKES" if chokes(report, max_delay_ms) else "")]
+    for output, stats in enumerate(report["outputs"]):
+        if stats["messages"]:
+            lines.append(f"  output {output + 1}: {stats['messages']} messages,"
+                         f" peak {stats['peak_messages_per_s']:.0f} msg/s, {stats['peak_bytes_per_s']:.0f} B/s")
+    return "\n".join(lines)
@@ -1,26 +1,51 @@
+import os
+import shutil
 import sys
+import threading
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QGridLayout,
-    QWidget, QLabel, QComboBox, QCheckBox, QPushButton, QMessageBox
+    QWidget, QLabel, QComboBox, QCheckBox, QPushButton, QMessageBox, QSpinBox, QInputDialog
 )
 from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import QSettings
-from mido import MidiFile, MidiTrack, Message, get_output_names, open_output, get_input_names, open_input
+from PyQt5.QtCore import Qt, QSettings, QStandardPaths, QTimer, pyqtSignal
+from mido import MidiFile, MidiTrack, Message
 
-SYSEX_START   = 0xF0
-SYSEX_END     = 0xF7
+import discovery
+from port_pool import PortPool
+from port_watcher import PortWatcher
+from routing_matrix import RoutingMatrix
+from presets import PresetLibrary
+from traffic_monitor import TrafficMonitor
+from router import SoftwareRouter, VIRTUAL_PORT_NAME, format_stats, open_outputs
+from device_cache import DeviceStateCache, push_routing
+from protocol import DEVICE, DEVICE_BROADCAST, NBR_OUTPUTS, SysexClient
 
-MANUFACTURER  = 0x7D	# non official ID for experiments and DIY 
-MODEL         = 0x18	# MIDI 1-8 ("0x8d" for MIDI8d, etc...)
-DEVICE        = 0x01	# first device (could be set by config for managing several identical chained devices)
+MONITOR_FPS = 15        # traffic monitor repaints per second
 
-COMMAND_PING_DEVICE      = 0x01
-COMMAND_READ_FROM_DEVICE = 0x02
-COMMAND_WRITE_TO_DEVICE  = 0x03
-COMMAND_CHANGE_DEVICE_ID = 0x04
+DEVICE_CACHE_FILE = "MIDI 1-8 devices.json"
+PRESET_LIBRARY_FILE = "MIDI 1-8 presets.m18"
+
+
+def move_legacy_data(old_dir, data_dir):
+    """Move the cache and presets of older versions, stored next to the settings file, to data_dir."""
+    for name in (DEVICE_CACHE_FILE, PRESET_LIBRARY_FILE, PRESET_LIBRARY_FILE + ".json"):
+        old_name, new_name = os.path.join(old_dir, name), os.path.join(data_dir, name)
+        if os.path.isfile(old_name) and not os.path.exists(new_name):
+            try:
+                shutil.move(old_name, new_name)
+            except OSError as e:
+                print(f"could not move {old_name} to {data_dir}: {e}")
 
 
 class MidiApp(QMainWindow):
+    # emitted from the SysEx worker thread, delivered in the Qt event loop
+    config_read = pyqtSignal(object)
+    config_read_failed = pyqtSignal(str)
+    config_written = pyqtSignal(str)
+    config_write_failed = pyqtSignal(str)
+    ports_scanned = pyqtSignal(object)
+    ports_changed = pyqtSignal(object, object)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("MIDI 1-8 Setup")
@@ -31,8 +56,55 @@ class MidiApp(QMainWindow):
         print("Reading settings from:")
         print(self.settings.fileName())
 
-        # Initialize checkbox states (2D array: 8 outputs × 17 channels)
-        self.checkbox_states = [[False for _ in range(17)] for _ in range(8)]
+        # MIDI ports are kept open between clicks, see port_pool.py
+        self.port_pool = PortPool()
+        self.sysex_client = SysexClient(self.port_pool)
+
+        # counting is done on the MIDI thread, the overlay is repainted at a capped frame rate
+        self.traffic_monitor = TrafficMonitor()
+        self.monitor_timer = QTimer(self)
+        self.monitor_timer.setInterval(1000 // MONITOR_FPS)
+        self.monitor_timer.timeout.connect(self.refresh_monitor)
+        self.monitor_active = [False] * 17
+        self.config_read.connect(self.apply_config_from_device)
+        self.config_read_failed.connect(
+            lambda error: QMessageBox.critical(self, "Error", f"Failed to read config from device: {error}")
+        )
+        self.config_written.connect(self.config_write_done)
+        self.config_write_failed.connect(
+            lambda error: QMessageBox.critical(self, "Error", f"Failed to send config through MIDI: {error}")
+        )
+
+        self.ports_scanned.connect(self.apply_scan_results)
+
+        # port names are listed on a watcher thread (started once the window is shown) and cached,
+        # the dropdowns are refreshed in place when an interface is plugged or unplugged
+        self.port_watcher = PortWatcher()
+        self.port_watcher.add_listener(self.ports_changed.emit)
+        self.ports_changed.connect(self.update_port_lists)
+
+        # the device cache and the presets go to the application data directory: the settings are
+        # not always a file (Windows registry)
+        data_dir = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+        os.makedirs(data_dir, exist_ok=True)
+        move_legacy_data(os.path.dirname(self.settings.fileName()), data_dir)
+
+        # last routing confirmed by each device; (port, device) confirmed by a read or a full write
+        # during this session (only touched by the SysEx worker thread)
+        self.confirmed_devices = set()
+        self.device_cache = DeviceStateCache(os.path.join(data_dir, DEVICE_CACHE_FILE))
+
+        # named routing matrices
+        self.preset_library = PresetLibrary(os.path.join(data_dir, PRESET_LIBRARY_FILE))
+
+        # Routing matrix (8 outputs × 17 channels), stored as the 17 channel masks sent to the device
+        self.routing = RoutingMatrix()
+        self.routing.add_listener(lambda routing: self.refresh_grid())
+        self.grid_masks = self.routing.masks()     # channel masks currently shown by the checkboxes
+
+        # host-side stand-in for a unit, routing the selected input with the grid (see router.py)
+        self.software_router = None
+        self.routing.add_listener(self.update_software_router)
 
         # left picture with front panel
         side_picture = QLabel()
@@ -53,10 +125,9 @@ class MidiApp(QMainWindow):
         midi_output_device_layout = QHBoxLayout()
         self.midi_output_device_label = QLabel("MIDI Output Device:")
         self.midi_output_device_dropdown = QComboBox()
-
-        #self.midi_output_device_dropdown.addItems(get_output_names())
-        self.midi_output_device_dropdown_items = get_output_names()
-        self.midi_output_device_dropdown.addItems(self.midi_output_device_dropdown_items)
+        # Qt 5.15+ only, older versions show an empty list until the ports are listed
+        if hasattr(self.midi_output_device_dropdown, "setPlaceholderText"):
+            self.midi_output_device_dropdown.setPlaceholderText("(listing MIDI ports...)")
 
         midi_output_device_layout.addWidget(self.midi_output_device_label)
         midi_output_device_layout.addWidget(self.midi_output_device_dropdown)
@@ -68,25 +139,37 @@ class MidiApp(QMainWindow):
         midi_input_device_layout = QHBoxLayout()
         self.midi_input_device_label = QLabel("MIDI Input Device:")
         self.midi_input_device_dropdown = QComboBox()
-
-        #self.midi_input_device_dropdown.addItems(get_input_names())
-        self.midi_input_device_dropdown_items = get_input_names()
-        self.midi_input_device_dropdown.addItems(self.midi_input_device_dropdown_items)
+        # Qt 5.15+ only, older versions show an empty list until the ports are listed
+        if hasattr(self.midi_input_device_dropdown, "setPlaceholderText"):
+            self.midi_input_device_dropdown.setPlaceholderText("(listing MIDI ports...)")
 
         midi_input_device_layout.addWidget(self.midi_input_device_label)
         midi_input_device_layout.addWidget(self.midi_input_device_dropdown)
         main_vbox_layout.addLayout(midi_input_device_layout)
 
-        # Restore previous selections
-        saved_output = self.settings.value("midi_output_device")
-        if saved_output in self.midi_output_device_dropdown_items:
-            index = self.midi_output_device_dropdown.findText(saved_output)
-            self.midi_output_device_dropdown.setCurrentIndex(index)
+        # (re)open ports only when the selection changes, previous selections are restored
+        # by update_port_lists once the ports are listed
+        self.midi_output_device_dropdown.currentTextChanged.connect(self.select_ports)
+        self.midi_input_device_dropdown.currentTextChanged.connect(self.select_ports)
+
+        # --------------------------------------------
+
+        # Device ID of the unit to configure (several units can be chained on the same ports)
+        device_id_layout = QHBoxLayout()
+        self.device_id_label = QLabel("Device ID:")
+        self.device_id_spinbox = QSpinBox()
+        self.device_id_spinbox.setRange(0, DEVICE_BROADCAST - 1)
+        self.device_id_spinbox.setValue(int(self.settings.value("device_id", DEVICE)))
+
+        device_id_layout.addWidget(self.device_id_label)
+        device_id_layout.addWidget(self.device_id_spinbox)
 
-        saved_input = self.settings.value("midi_input_device")
-        if saved_input in self.midi_input_device_dropdown_items:
-            index = self.midi_input_device_dropdown.findText(saved_input)
-            self.midi_input_device_dropdown.setCurrentIndex(index)
+        # find which output/input pair reaches which device, and pick the fastest one
+        self.scan_button = QPushButton("Scan ports")
+        self.scan_button.clicked.connect(self.scan_ports)
+        device_id_layout.addWidget(self.scan_button)
+        device_id_layout.addStretch(1)
+        main_vbox_layout.addLayout(device_id_layout)
 
         # --------------------------------------------
 
@@ -95,12 +178,15 @@ class MidiApp(QMainWindow):
 
         # Add column headers (1–16 and RT)
         self.output_matrix_grid_layout.addWidget(QLabel("Channels:"), 0, 0)
+        self.channel_headers = []                           # kept for the traffic monitor overlay
         for i in range(16):
             header = QLabel(str(i + 1))                     # MIDI channels are 1..16
             self.output_matrix_grid_layout.addWidget(header, 0, i + 1)      # first row of the grid, from the second colmun
+            self.channel_headers.append(header)
 
         rt_header = QLabel("RT")
         self.output_matrix_grid_layout.addWidget(rt_header, 0, 17)          # first row of the grid, colmun 18
+        self.channel_headers.append(rt_header)
 
 
         # Populate the grid with outputs and checkboxes
@@ -148,6 +234,37 @@ class MidiApp(QMainWindow):
         '''
 
         main_vbox_layout.addLayout(self.output_matrix_grid_layout)
+
+        # whole matrix operations, each one refreshes the grid once
+        matrix_buttons_layout = QHBoxLayout()
+        for text, action in (("All", lambda: self.routing.set_all(True)),
+                             ("None", lambda: self.routing.set_all(False)),
+                             ("Invert", self.routing.invert),
+                             ("Transpose 1-8", self.routing.transpose)):
+            matrix_button = QPushButton(text)
+            matrix_button.clicked.connect(lambda _, action=action: action())
+            matrix_buttons_layout.addWidget(matrix_button)
+        matrix_buttons_layout.addStretch(1)
+
+        # incoming traffic monitor, overlaid on the grid
+        self.monitor_checkbox = QCheckBox("Monitor input")
+        self.monitor_checkbox.toggled.connect(self.toggle_monitor)
+        matrix_buttons_layout.addWidget(self.monitor_checkbox)
+
+        # route the selected input to virtual outputs, as the unit would
+        self.router_checkbox = QCheckBox("Software router")
+        self.router_checkbox.toggled.connect(self.toggle_software_router)
+        matrix_buttons_layout.addWidget(self.router_checkbox)
+        main_vbox_layout.addLayout(matrix_buttons_layout)
+
+        # last grid row: messages per second received on each channel
+        self.output_matrix_grid_layout.addWidget(QLabel("msg/s:"), 9, 0)
+        self.channel_rate_labels = []
+        for col in range(17):  # 16 channels + RT
+            rate_label = QLabel("")
+            self.output_matrix_grid_layout.addWidget(rate_label, 9, col + 1)
+            self.channel_rate_labels.append(rate_label)
+
         main_vbox_layout.addStretch(1)
         
         # Send Button
@@ -156,6 +273,23 @@ class MidiApp(QMainWindow):
 #        self.send_button.clicked.connect(self.send_config)
 #        main_vbox_layout.addWidget(self.send_button)
 
+        # presets row: recall loads a preset in the grid and sends it to the device at once
+        presets_layout = QHBoxLayout()
+        presets_layout.addWidget(QLabel("Preset:"))
+        self.preset_dropdown = QComboBox()
+        self.preset_dropdown.addItems(self.preset_library.names())
+        presets_layout.addWidget(self.preset_dropdown, 1)
+
+        recall_button = QPushButton("Recall")
+        recall_button.clicked.connect(self.recall_preset)
+        presets_layout.addWidget(recall_button)
+
+        save_preset_button = QPushButton("Save as preset...")
+        save_preset_button.clicked.connect(self.save_preset)
+        presets_layout.addWidget(save_preset_button)
+
+        main_vbox_layout.addLayout(presets_layout)
+
         # last row: retrieve and send buttons in horizontal layout
         receive_send_config_layout = QHBoxLayout()
 
@@ -166,6 +300,7 @@ class MidiApp(QMainWindow):
 
         # send to device button
         send_button = QPushButton("Send configuration to device")
+        send_button.setToolTip("Only the changes are sent; hold Shift to send the whole configuration")
         send_button.clicked.connect(self.write_config_to_device)
         receive_send_config_layout.addWidget(send_button)
 
@@ -176,20 +311,167 @@ class MidiApp(QMainWindow):
         self.setCentralWidget(main_widget)
         main_widget.setLayout(main_hbox_layout)             # attach the frontpanel and the controls
 
+        # list the ports once the event loop runs, i.e. after the window is shown
+        QTimer.singleShot(0, self.port_watcher.start)
+
+    def select_ports(self, _=None):
+        """Hand the current dropdown selections to the port pool, and remember them."""
+        output_name = self.midi_output_device_dropdown.currentText()
+        input_name = self.midi_input_device_dropdown.currentText()
+        self.port_pool.select(output_name, input_name)
+
+        # an unplugged device leaves its dropdown empty: keep it as the one to select when it comes back
+        if output_name:
+            self.settings.setValue("midi_output_device", output_name)
+        if input_name:
+            self.settings.setValue("midi_input_device", input_name)
+        if (self.monitor_timer.isActive() or self.software_router is not None) and input_name:
+            self.port_pool.listen()         # keep monitoring/routing the newly selected input
+
+    def update_port_lists(self, output_names, input_names):
+        """Refresh both dropdowns in place with the listed ports, keeping the saved selections."""
+        changed = False
+        for dropdown, names, key in ((self.midi_output_device_dropdown, output_names, "midi_output_device"),
+                                     (self.midi_input_device_dropdown, input_names, "midi_input_device")):
+            current = dropdown.currentText()
+            wanted = self.settings.value(key) or current
+            dropdown.blockSignals(True)
+            dropdown.clear()
+            dropdown.addItems(names)
+            if wanted in names:
+                dropdown.setCurrentIndex(names.index(wanted))
+            elif wanted:
+                dropdown.setCurrentIndex(-1)        # selected device unplugged, wait for it
+            dropdown.blockSignals(False)
+            changed |= dropdown.currentText() != current
+        if changed:
+            # a replugged device was deselected while away, so its ports are reopened fresh here
+            self.select_ports()
+
+    def scan_ports(self):
+        """Ping every output and listen to every input, on a worker thread."""
+        print("scanning MIDI ports...")
+        self.scan_button.setEnabled(False)
+        self.port_pool.close()          # some backends do not allow a port to be opened twice
+
+        def worker():
+            try:
+                # cached port names, if they were listed already
+                pairs = discovery.scan(self.port_watcher.output_names, self.port_watcher.input_names)
+            except Exception as e:
+                print(f"scan failed: {e}")
+                pairs = []
+            self.ports_scanned.emit(pairs)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def apply_scan_results(self, pairs):
+        """Select the lowest latency port pair, for the current device ID if it answered."""
+        self.scan_button.setEnabled(True)
+        for pair in pairs:
+            print(f"device {pair.device:02X}: {pair.output} -> {pair.input}, {pair.rtt * 1000:.1f} ms")
+        if pairs:
+            best = discovery.best_pairs(pairs)
+            pair = best.get(self.device_id_spinbox.value(), pairs[0])
+            self.midi_output_device_dropdown.setCurrentText(pair.output)
+            self.midi_input_device_dropdown.setCurrentText(pair.input)
+            self.device_id_spinbox.setValue(pair.device)
+
+        # the scan closed the ports: reopen the input if the monitor or the software router uses it
+        # (select_ports only does it when the selection changed)
+        if (self.monitor_timer.isActive() or self.software_router is not None) \
+                and self.midi_input_device_dropdown.currentText():
+            try:
+                self.port_pool.listen()
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"Failed to reopen MIDI input: {e}")
+
+        if not pairs:
+            QMessageBox.warning(self, "Scan", "No device answered.")
+
+    def toggle_monitor(self, enabled):
+        """Start/stop counting incoming messages on the selected input port."""
+        if enabled:
+            self.traffic_monitor.reset()
+            try:
+                self.port_pool.listen()
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"Failed to open MIDI input: {e}")
+                self.monitor_checkbox.setChecked(False)
+                return
+            self.port_pool.add_listener(self.traffic_monitor.on_message)
+            self.monitor_timer.start()
+        else:
+            self.port_pool.remove_listener(self.traffic_monitor.on_message)
+            self.monitor_timer.stop()
+            self.monitor_active = [False] * 17
+            self.paint_monitor([0.0] * 17)
+
+    def toggle_software_router(self, enabled):
+        """Start/stop routing the selected input to the virtual outputs "MIDI 1-8 out 1" to 8."""
+        if enabled:
+            try:
+                ports = open_outputs([VIRTUAL_PORT_NAME.format(output + 1) for output in range(NBR_OUTPUTS)],
+                                     virtual=True)
+                self.software_router = SoftwareRouter(ports, self.routing.masks())
+                self.port_pool.listen()
+            except Exception as e:
+                if self.software_router is not None:
+                    self.software_router.close()
+                    self.software_router = None
+                QMessageBox.critical(self, "Error", f"Failed to start the software router: {e}")
+                self.router_checkbox.setChecked(False)
+                return
+            self.port_pool.add_listener(self.software_router.on_message)
+        elif self.software_router is not None:
+            self.port_pool.remove_listener(self.software_router.on_message)
+            self.software_router.close()
+            print(format_stats(self.software_router))
+            self.software_router = None
+
+    def update_software_router(self, routing):
+        # grid edits apply to the running router right away
+        if self.software_router is not None:
+            self.software_router.set_routing(routing.masks())
+
+    def refresh_monitor(self):
+        self.paint_monitor(self.traffic_monitor.rates(), self.traffic_monitor.active())
+
+    def paint_monitor(self, rates, active=None):
+        """Show rates under the grid and highlight the columns receiving traffic (only what changed)."""
+        active = active or [False] * 17
+        for col in range(17):  # 16 channels + RT
+            self.channel_rate_labels[col].setText(f"{rates[col]:.0f}" if rates[col] else "")
+            if active[col] == self.monitor_active[col]:
+                continue
+            style = "background-color: #7fd07f;" if active[col] else ""
+            self.channel_headers[col].setStyleSheet(style)
+            for row in range(8):
+                checkbox = self.output_matrix_grid_layout.itemAtPosition(row + 1, col + 1).widget()
+                checkbox.setStyleSheet(style)
+        self.monitor_active = list(active)
+
+    def send_sysex(self, sysex_message):
+        """Send a complete SysEx message (F0 ... F7) through the port pool."""
+        self.port_pool.send(Message('sysex', data=sysex_message[1:-1]))      # Exclude F0 and F7 as mido handles these internally for 'sysex' messages
+        print("SysEx message sent!")
+        print(self.port_pool.stats_text())
+
+    @property
+    def checkbox_states(self):
+        """8 × 17 list of bools, built from the routing matrix."""
+        return self.routing.to_states()
+
     def update_checkbox_state(self, row, col, state):
-        """Update the state of a checkbox in the 2D array."""
-        self.checkbox_states[row][col] = state == 2  # 2 means "Checked"
+        """Update the routing matrix when a checkbox is toggled."""
+        self.routing.set(row, col, state == 2)  # 2 means "Checked"
         #print(f"check state [{row}][{col}] = {state}")
 
     def toggle_row(self, row, check_state):
-        """Toggle all checkboxes in a row."""
-        for col in range(17):  # 16 channels + RT
-            checkbox = self.output_matrix_grid_layout.itemAtPosition(row + 1, col + 1).widget()
-            checkbox.setChecked(check_state)
-            self.checkbox_states[row][col] = check_state
+        """Toggle all checkboxes in a row (the grid is refreshed once)."""
+        self.routing.set_row(row, check_state)
 
     def send_midi_note(self):
-        selected_device = self.midi_output_device_dropdown.currentText()
         #enabled_channels = [i + 1 for i, cb in enumerate(self.channel_checkboxes) if cb.isChecked()]
 
         '''
@@ -199,59 +481,77 @@ class MidiApp(QMainWindow):
         '''
 
         try:
-            with open_output(selected_device) as outport:
-                for channel in range(16):
-                    value = 0
-                    #print("channel:")
-                    for output in range(8):
-                        value = (value << 1) + (self.checkbox_states[output][channel])
-                    print("channel: ", channel, " ", format(value, 'b').zfill(8))
-                        # Send a Note On message (Middle C) to the enabled channels
-                        #outport.send(Message('note_on', note=60, velocity=64, channel=channel - 1))
-                #QMessageBox.information(self, "Success", f"Sent note to channels: {enabled_channels}")
+            outport = self.port_pool.output()
+            for channel in range(16):
+                value = 0
+                #print("channel:")
+                for output in range(8):
+                    value = (value << 1) + self.routing.get(output, channel)
+                print("channel: ", channel, " ", format(value, 'b').zfill(8))
+                    # Send a Note On message (Middle C) to the enabled channels
+                    #outport.send(Message('note_on', note=60, velocity=64, channel=channel - 1))
+            #QMessageBox.information(self, "Success", f"Sent note to channels: {enabled_channels}")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to send MIDI note: {e}")
 
     def test_send_midi_sysex(self):
         # send SysEx [Mf. ID + Command ID + LED1 .. LED8 status]
         sysex_message = [0xF0, 0x7D, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0xF7]
-        
-        selected_device = self.midi_output_device_dropdown.currentText()
+
         try:
-            with open_output(selected_device) as outport:
-                outport.send(Message('sysex', data=sysex_message[1:-1]))  # Exclude F0 and F7
-                print("SysEx message sent!")
+            self.send_sysex(sysex_message)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to send MIDI note: {e}")
 
     def read_config_from_device(self):
-        # send a read request then listen for the answer
+        # send a read request then listen for the answer, on a worker thread so the UI stays responsive
         print("retrieve data from device...")
 
-        selected_input_device = self.midi_input_device_dropdown.currentText()
-        selected_output_device = self.midi_output_device_dropdown.currentText()
-
-        sysex_message = [SYSEX_START, MANUFACTURER, MODEL, DEVICE, COMMAND_READ_FROM_DEVICE]
-        sysex_message.append(SYSEX_END)  # close the message
-        print(" ".join(f"{byte:02X}" for byte in sysex_message))
-
-        try:
-            with open_output(selected_output_device) as outport:
-                outport.send(Message('sysex', data=sysex_message[1:-1]))      # Exclude F0 and F7 as mido handles these internally for 'sysex' messages
-                print("SysEx message sent!")
-                #QMessageBox.information(self, "Success", f"Sent note to channels: {enabled_channels}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to send config through MIDI: {e}")
+        self.sysex_client.request_async(
+            lambda client, device=self.device_id_spinbox.value(): self.read_and_cache(client, device),
+            self.config_read.emit,
+            lambda e: self.config_read_failed.emit(str(e))
+        )
+
+    def read_and_cache(self, client, device):
+        """Read the routing (worker thread) and remember it as the confirmed device state."""
+        enabled_outputs = client.read_routing(device)
+        self.device_cache.set(self.port_pool.output_name, device, enabled_outputs)
+        self.confirmed_devices.add((self.port_pool.output_name, device))
+        return enabled_outputs
+
+    def apply_config_from_device(self, enabled_outputs):
+        """Refresh the whole grid from the 17 channel masks read from the device."""
+        print("Enabled outputs (from device):")
+        print(" ".join(f"{byte:02X}" for byte in enabled_outputs))
 
+        self.routing.set_masks(enabled_outputs)     # the grid is refreshed by the routing listener
+
+    def refresh_grid(self):
+        """Update the checkboxes changed in the routing matrix, without firing stateChanged for each of them."""
+        masks = self.routing.masks()
+        for col, (shown, mask) in enumerate(zip(self.grid_masks, masks)):    # 16 channels + RT
+            changed = shown ^ mask
+            if not changed:
+                continue
+            for row in range(8):
+                if not changed & (1 << row):
+                    continue
+                state = bool(mask & (1 << row))
+                checkbox = self.output_matrix_grid_layout.itemAtPosition(row + 1, col + 1).widget()
+                # a single click already shows its new state: nothing to repaint
+                if checkbox.isChecked() != state:
+                    checkbox.blockSignals(True)
+                    checkbox.setChecked(state)
+                    checkbox.blockSignals(False)
+        self.grid_masks = masks
 
     def write_config_to_device(self):
         #manufacturer = 0x7D
         #model = 0x01
         #device = 0x01
         #command = 0x02
-        sysex_message = [SYSEX_START, MANUFACTURER, MODEL, DEVICE, COMMAND_WRITE_TO_DEVICE]
 
-        selected_device = self.midi_output_device_dropdown.currentText()
         '''
         for channel in range(16):
             enabled_outputs = 0
@@ -362,38 +662,71 @@ class MidiApp(QMainWindow):
         print("    last car: \t", format(carry, 'b').zfill(8))
         sysex_message += [carry]
         '''
-        #enabled_outputs = []
-        # Initialize array: × 17 channels
-        enabled_outputs = [False for _ in range(17)]
-
-        
-        for channel in range(17):   # 16 channels + RT
-            enabled_outputs[channel] = 0
-            for output in range(8):
-                if self.checkbox_states[output][channel]:
-                    enabled_outputs[channel] |= (1 << output)
+        # the routing matrix already holds the 17 channel masks (bit n = output n + 1)
+        enabled_outputs = self.routing.masks()
 
         print("Enabled outputs:")
         print(" ".join(f"{byte:02X}" for byte in enabled_outputs))
 
-        packed_message = [0] * 20
-        convert_to_7bit_message(enabled_outputs, packed_message)
-        print("Packed message:")
-        print(packed_message)
-        sysex_message += packed_message
-        sysex_message.append(SYSEX_END)  # close the message
+        # only the channels which differ from the last confirmed device state are sent, except for the first
+        # write of the session to a device (the unit may have been reset or swapped) or with Shift held
+        device = self.device_id_spinbox.value()
+        force = bool(QApplication.keyboardModifiers() & Qt.ShiftModifier)
+        self.sysex_client.request_async(
+            lambda client: self.push_and_confirm(client, device, enabled_outputs, force),
+            self.config_written.emit,
+            lambda e: self.config_write_failed.emit(str(e))
+        )
+
+    def push_and_confirm(self, client, device, enabled_outputs, force=False):
+        """Write the routing (SysEx worker thread, where the jobs run in order)."""
+        key = (self.port_pool.output_name, device)
+        write_mode = push_routing(client, self.device_cache, device, enabled_outputs,
+                                  force or key not in self.confirmed_devices)
+        self.confirmed_devices.add(key)
+        return write_mode
+
+    def recall_preset(self):
+        """Load the selected preset in the grid and send its pre-built frame to the device."""
+        name = self.preset_dropdown.currentText()
+        if name not in self.preset_library:
+            return
 
-        print("sysex message:")
-        #print(sysex_message)
-        print(" ".join(f"{byte:02X}" for byte in sysex_message))
+        enabled_outputs = self.preset_library.get(name)
+        self.routing.set_masks(enabled_outputs)
 
-        try:
-            with open_output(selected_device) as outport:
-                outport.send(Message('sysex', data=sysex_message[1:-1]))      # Exclude F0 and F7 as mido handles these internally for 'sysex' messages
-                print("SysEx message sent!")
-                #QMessageBox.information(self, "Success", f"Sent note to channels: {enabled_channels}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to send config through MIDI: {e}")
+        device = self.device_id_spinbox.value()
+        frame = self.preset_library.frame(name, device)
+
+        def recall(client):
+            client.exchange(frame)
+            self.device_cache.set(self.port_pool.output_name, device, enabled_outputs)
+            return f"preset {name}"
+
+        self.sysex_client.request_async(
+            recall,
+            self.config_written.emit,
+            lambda e: self.config_write_failed.emit(str(e))
+        )
+
+    def save_preset(self):
+        """Store the current grid as a named preset (tags are optional, after a '#')."""
+        text, ok = QInputDialog.getText(self, "Save preset", "Preset name (#tag1 #tag2...):",
+                                        text=self.preset_dropdown.currentText())
+        if not ok or not text.split("#")[0].strip():
+            return
+
+        name, *tags = [part.strip() for part in text.split("#")]
+        self.preset_library.save(name, self.routing.masks(), [tag for tag in tags if tag])
+
+        self.preset_dropdown.clear()
+        self.preset_dropdown.addItems(self.preset_library.names())
+        self.preset_dropdown.setCurrentText(name)
+
+    def config_write_done(self, write_mode):
+        print(f"Configuration write: {write_mode}")
+        print(self.port_pool.stats_text())
+        print(self.port_pool.instrumentation.summary())
 
     '''
         def convert_to_7bit_message(bytes, packed_message):
@@ -427,59 +760,21 @@ class MidiApp(QMainWindow):
 
 
     def closeEvent(self, event):
-        # Save MIDI device dropdown combo settings before closing the application
+        # Save settings before closing the application
         print("Saving settings...")
-        self.settings.setValue("midi_output_device", self.midi_output_device_dropdown.currentText())
-        self.settings.setValue("midi_input_device", self.midi_input_device_dropdown.currentText())
+        # (the MIDI device selections are saved as soon as they are made, see select_ports)
+        self.settings.setValue("device_id", self.device_id_spinbox.value())
+        self.port_watcher.stop()
+        self.port_pool.close()
+        if self.software_router is not None:
+            self.software_router.close()
+        self.preset_library.close()
         super().closeEvent(event)
 
-def convert_to_7bit_message(byte_message, packed_message):
-    carry = 0x00
-    carry_idx = 0
-    packed_idx = 1
-    carry_cnt = 0
-    #packed_data = 0x00
-
-    for byte in byte_message:
-        '''
-        print("\n  byte:   \t\t " + f'{byte:08b}' + ' (' + f'{byte:02X}' + ')')
-
-        print("    carry_cnt:   \t", carry_cnt)
-        print("    carry_idx:   \t", carry_idx)
-        print("    packed_idx:  \t", packed_idx)
-        '''
-        # keep lower 7 bits
-        #packed_data = byte & 0x7F                      # First 7 bits, mask is 0x7F (0111 1111)
-        #print("    packed_data: \t " + f'{packed_data:08b}' + ' (' + f'{packed_data:02X}' + ')')
-
-        #packed_message[packed_idx] = packed_data       # store packed data in message
-        #packed_message += [byte & 0x7F]
-        #packed_message += []                           # make some room
-        packed_message[packed_idx] = byte & 0x7F        # Store first 7 bits, mask is 0x7F (0111 1111)
-        packed_idx = packed_idx + 1
-
-        # Collect MSBs in carry
-        carry |= (byte & 0x80) >> carry_cnt + 1        # 8th bit is kept aside (reverse order: 1st is MSB)  mask is 0x80 (1000 0000)
-        #print("    carry: \t\t " + f'{carry:08b}' + ' (' + f'{carry:02X}' + ')')
-        carry_cnt = carry_cnt + 1
-
-        if carry_cnt == 7:                             # if 7th byte
-            carry_cnt = 0                              # reset carry counter
-            #print ("  reset carry_cnt")
-
-            packed_message[carry_idx] = carry          # save previous carry at previously saved position
-
-            carry = 0x00                               # new carry
-            
-            carry_idx = packed_idx                     # save new carry position
-            packed_idx = packed_idx + 1                # next packed_data will be stored after carry
-        
-        
-    packed_message[carry_idx] = carry              # save last carry at saved position
-
-
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    app.setOrganizationName("David Haillant")     # same names as the QSettings, for the data directory
+    app.setApplicationName("MIDI 1-8")
     window = MidiApp()
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,157 @@
+"""
+Long-lived MIDI port sessions.
+
+Opening an rtmidi/ALSA port costs tens of milliseconds and some USB
+interfaces drop the first bytes sent on a freshly opened port, so the
+setup tool keeps one output and one input port open for the selected
+devices and only reopens them when the selection changes or a send fails
+(device unplugged, interface reset...).
+"""
+import threading
+
+from instrumentation import LinkStats
+
+
+class PortPool:
+    """Keep the selected output/input ports open and share them between all SysEx exchanges."""
+
+    def __init__(self, open_output=None, open_input=None, instrumentation=None):
+        # openers are injectable so that emulated/loopback ports can be used instead of mido ones
+        self._open_output = open_output
+        self._open_input = open_input
+
+        self._lock = threading.RLock()
+        self.output_name = None
+        self.input_name = None
+        self._output = None
+        self._input = None
+        self._listeners = []
+
+        # open: port opened for the first time after a selection
+        # reuse: an exchange was served by the already open ports (counted once per exchange)
+        # reconnect: a port had to be closed and opened again (device went away)
+        self.stats = {"opened": 0, "reused": 0, "reconnected": 0}
+
+        # phase timings, message/byte counters and latencies of this link
+        self.instrumentation = instrumentation or LinkStats()
+
+    def select(self, output_name=None, input_name=None):
+        """Change the selected devices. Ports are closed now and reopened lazily on next use."""
+        with self._lock:
+            if output_name is not None and output_name != self.output_name:
+                self._close_output()
+                self.output_name = output_name
+            if input_name is not None and input_name != self.input_name:
+                self._close_input()
+                self.input_name = input_name
+
+    def output(self):
+        """Return the open output port, opening it if required."""
+        with self._lock:
+            if self._output is not None and not self._output.closed:
+                return self._output
+
+            if not self.output_name:
+                raise IOError("no MIDI output device selected")
+
+            if self._open_output is None:
+                from mido import open_output
+                self._open_output = open_output
+
+            with self.instrumentation.phase("port_open"):
+                self._output = self._open_output(self.output_name)
+            self.stats["opened"] += 1
+            return self._output
+
+    def prepare_exchange(self):
+        """Open the output and the input for a request/reply exchange, counting a reuse if both were open."""
+        with self._lock:
+            reused = (self._output is not None and not self._output.closed
+                      and self._input is not None and not self._input.closed)
+            self.output()
+            self.listen()
+            if reused:
+                self.stats["reused"] += 1
+
+    def send(self, message):
+        """Send a message on the selected output, reconnecting once if the device went away."""
+        with self._lock:
+            port = self.output()
+            with self.instrumentation.phase("send"):
+                try:
+                    port.send(message)
+                except Exception:
+                    # the interface may have been unplugged/replugged: try again on a fresh port
+                    self._close_output()
+                    self.output().send(message)
+                    self.stats["opened"] -= 1
+                    self.stats["reconnected"] += 1
+            self.instrumentation.count_sent(len(message))
+
+    def listen(self):
+        """Make sure the selected input port is open and dispatching to listeners."""
+        with self._lock:
+            if self._input is not None and not self._input.closed:
+                return self._input
+
+            if not self.input_name:
+                raise IOError("no MIDI input device selected")
+
+            if self._open_input is None:
+                from mido import open_input
+                self._open_input = open_input
+
+            # the callback is run by the backend thread, never by the Qt event loop
+            with self.instrumentation.phase("port_open"):
+                self._input = self._open_input(self.input_name, callback=self._dispatch)
+            self.stats["opened"] += 1
+            return self._input
+
+    def reconnect_input(self):
+        """Close and reopen the input port (e.g. after the device was replugged)."""
+        with self._lock:
+            self._close_input()
+            self.listen()
+            self.stats["opened"] -= 1
+            self.stats["reconnected"] += 1
+
+    def add_listener(self, listener):
+        """Register a callable receiving every incoming message (called from the backend thread)."""
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners = [l for l in self._listeners if l is not listener]
+
+    def _dispatch(self, message):
+        self.instrumentation.count_received(len(message))
+        # the list is replaced (never mutated) on add/remove, so no lock is needed here
+        for listener in self._listeners:
+            listener(message)
+
+    def _close_output(self):
+        if self._output is not None:
+            try:
+                self._output.close()
+            except Exception:
+                pass
+            self._output = None
+
+    def _close_input(self):
+        if self._input is not None:
+            try:
+                self._input.close()
+            except Exception:
+                pass
+            self._input = None
+
+    def close(self):
+        """Close every open port."""
+        with self._lock:
+            self._close_output()
+            self._close_input()
+
+    def stats_text(self):
+        return "ports opened: {opened}, reused: {reused}, reconnected: {reconnected}".format(**self.stats)
@@ -0,0 +1,78 @@
+"""
+Background MIDI port enumeration with hot-plug watching.
+
+Listing ports goes through the MIDI backend, which can be slow (ALSA
+sequencer, Windows MME with many devices) or even hang on a misbehaving
+driver. The names are listed on a watcher thread and cached; the thread
+polls the backend every interval seconds (mido has no hot-plug
+notification) and calls the listeners only when a list changed, so the
+GUI never waits for the backend.
+"""
+import threading
+
+
+class PortWatcher:
+    """Cached output/input port names, refreshed by a polling thread."""
+
+    def __init__(self, get_output_names=None, get_input_names=None, interval=2.0):
+        # listers are injectable so that emulated ports can be used instead of mido ones
+        self._get_output_names = get_output_names
+        self._get_input_names = get_input_names
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._thread = None
+        self._stopped = threading.Event()
+
+        # None until the first enumeration is done
+        self.output_names = None
+        self.input_names = None
+
+    def add_listener(self, listener):
+        """Register listener(output_names, input_names), called from the watcher thread on every change."""
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners = [l for l in self._listeners if l is not listener]
+
+    def start(self):
+        """Start watching (the first enumeration is done right away, on the watcher thread)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def refresh(self):
+        """Enumerate the ports now. Return True if a list changed (listeners were called)."""
+        if self._get_output_names is None or self._get_input_names is None:
+            import mido
+            self._get_output_names = self._get_output_names or mido.get_output_names
+            self._get_input_names = self._get_input_names or mido.get_input_names
+
+        output_names = list(self._get_output_names())
+        input_names = list(self._get_input_names())
+        if output_names == self.output_names and input_names == self.input_names:
+            return False
+
+        self.output_names = output_names
+        self.input_names = input_names
+        # the list is replaced (never mutated) on add/remove, so no lock is needed here
+        for listener in self._listeners:
+            listener(output_names, input_names)
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                # backend error (e.g. ALSA sequencer restarted): keep the cache, try again later
+                print(f"MIDI port enumeration failed: {e}")
+            self._stopped.wait(self.interval)
@@ -0,0 +1,130 @@
+"""
+Preset library: named routing matrices stored on disk.
+
+Two files per library:
+    <library>           binary data: 8 bytes header (b"M18P", version, 3 reserved bytes)
+                        followed by one 17 bytes record per preset (the channel masks)
+    <library>.json      index: {"version": 1, "presets": {name: {"slot": n, "tags": [...]}}}
+
+The data file is memory-mapped, so opening a library of thousands of presets
+only reads the (small) index; a preset is read when it is recalled.
+Recall frames are built once per preset and device ID, then reused.
+"""
+import json
+import mmap
+import os
+import threading
+
+from protocol import NBR_CHANNELS, COMMAND_WRITE_TO_DEVICE, build_message, encode_routing
+
+MAGIC       = b"M18P"
+VERSION     = 1
+HEADER_SIZE = 8
+RECORD_SIZE = NBR_CHANNELS
+
+
+class PresetLibrary:
+    """Named routing matrices (17 channel masks each), with tags."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.index_file_name = file_name + ".json"
+        self._lock = threading.RLock()
+        self._map = None
+        self._frames = {}               # (name, device) -> mido message, see frame()
+
+        try:
+            with open(self.index_file_name) as f:
+                self._presets = json.load(f)["presets"]
+        except (OSError, ValueError, KeyError):
+            self._presets = {}
+
+        if not os.path.exists(file_name):
+            with open(file_name, "wb") as f:
+                f.write(MAGIC + bytes((VERSION, 0, 0, 0)))
+        with open(file_name, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if header[:4] != MAGIC or header[4] != VERSION:
+            raise ValueError(f"{file_name} is not a MIDI 1-8 preset library")
+
+    # ---- read access ----
+
+    def _data(self):
+        """Memory map of the data file (mapped on first use, remapped after writes)."""
+        if self._map is None:
+            with open(self.file_name, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def __len__(self):
+        return len(self._presets)
+
+    def __contains__(self, name):
+        return name in self._presets
+
+    def names(self, tag=None):
+        """Preset names, sorted, optionally only those with a given tag."""
+        with self._lock:
+            return sorted(name for name, entry in self._presets.items() if tag is None or tag in entry["tags"])
+
+    def tags(self, name):
+        return list(self._presets[name]["tags"])
+
+    def get(self, name):
+        """Return the 17 channel masks of a preset, as bytes."""
+        with self._lock:
+            offset = HEADER_SIZE + self._presets[name]["slot"] * RECORD_SIZE
+            return self._data()[offset:offset + RECORD_SIZE]
+
+    def frame(self, name, device):
+        """The COMMAND_WRITE_TO_DEVICE message recalling a preset, built once and cached."""
+        with self._lock:
+            key = (name, device)
+            if key not in self._frames:
+                self._frames[key] = build_message(COMMAND_WRITE_TO_DEVICE, encode_routing(self.get(name)), device)
+            return self._frames[key]
+
+    # ---- edits ----
+
+    def save(self, name, enabled_outputs, tags=()):
+        """Store (or overwrite) a preset."""
+        enabled_outputs = bytes(enabled_outputs)
+        if len(enabled_outputs) != RECORD_SIZE:
+            raise ValueError(f"expected {RECORD_SIZE} channel masks, got {len(enabled_outputs)}")
+
+        with self._lock:
+            entry = self._presets.get(name)
+            if entry is None:
+                # reuse the slot of a deleted preset, if any
+                used = {entry["slot"] for entry in self._presets.values()}
+                slot = next(slot for slot in range(len(used) + 1) if slot not in used)
+                entry = self._presets[name] = {"slot": slot, "tags": []}
+            entry["tags"] = sorted(set(tags))
+
+            self._close_map()
+            with open(self.file_name, "r+b") as f:
+                f.seek(HEADER_SIZE + entry["slot"] * RECORD_SIZE)
+                f.write(enabled_outputs)
+            self._frames = {key: frame for key, frame in self._frames.items() if key[0] != name}
+            self._save_index()
+
+    def delete(self, name):
+        with self._lock:
+            del self._presets[name]
+            self._frames = {key: frame for key, frame in self._frames.items() if key[0] != name}
+            self._save_index()
+
+    def _save_index(self):
+        temp_name = self.index_file_name + ".tmp"
+        with open(temp_name, "w") as f:
+            json.dump({"version": VERSION, "presets": self._presets}, f)
+        os.replace(temp_name, self.index_file_name)
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        with self._lock:
+            self._close_map()
@@ -0,0 +1,292 @@
+"""
+MIDI 1-8 SysEx protocol, shared by the setup GUI and the command line tools.
+
+Every message is framed as:
+
+    F0 <MANUFACTURER> <MODEL> <DEVICE> <COMMAND> [7-bit packed payload] F7
+
+The device answers a request with the same header and command, followed by
+its own payload (e.g. the packed routing for COMMAND_READ_FROM_DEVICE, nothing
+for a write acknowledge). A ping reply echoes the ping payload, if any.
+COMMAND_CHANGE_DEVICE_ID carries the new ID as payload and is acknowledged by
+the device under its new ID. COMMAND_WRITE_CHANNELS only updates the given
+channels and is acknowledged like COMMAND_WRITE_TO_DEVICE.
+
+This module does not import Qt nor mido at load time.
+"""
+import queue
+import threading
+import time
+
+import sysex7bit
+
+SYSEX_START   = 0xF0
+SYSEX_END     = 0xF7
+
+MANUFACTURER  = 0x7D	# non official ID for experiments and DIY 
+MODEL         = 0x18	# MIDI 1-8 ("0x8d" for MIDI8d, etc...)
+DEVICE        = 0x01	# first device (could be set by config for managing several identical chained devices)
+
+COMMAND_PING_DEVICE      = 0x01
+COMMAND_READ_FROM_DEVICE = 0x02
+COMMAND_WRITE_TO_DEVICE  = 0x03
+COMMAND_CHANGE_DEVICE_ID = 0x04
+COMMAND_WRITE_CHANNELS   = 0x05	# partial write: packed (channel, enabled outputs) pairs
+COMMAND_BULK_BEGIN       = 0x06	# bulk transfer, see bulk.py
+COMMAND_BULK_CHUNK       = 0x07
+COMMAND_BULK_ACK         = 0x08
+COMMAND_BULK_END         = 0x09
+
+DEVICE_BROADCAST = 0x7F	# every device answers a ping sent to this ID with its own ID
+
+NBR_OUTPUTS  = 8
+NBR_CHANNELS = 17                       # 16 channels + RT
+ROUTING_PACKED_SIZE = sysex7bit.packed_size(NBR_CHANNELS)     # 20 bytes: 17 + 17 MOD 7 carries
+
+
+class SysexError(Exception):
+    """A SysEx exchange with the device failed."""
+
+
+class SysexTimeout(SysexError):
+    """The device did not answer in time."""
+
+
+def build_sysex(command, payload=(), device=DEVICE):
+    """Return a complete SysEx message (F0 ... F7) as a list of bytes."""
+    sysex_message = [SYSEX_START, MANUFACTURER, MODEL, device, command]
+    sysex_message += payload
+    sysex_message.append(SYSEX_END)  # close the message
+    return sysex_message
+
+
+def build_message(command, payload=(), device=DEVICE):
+    """Return a mido SysEx message ready to be sent (mido adds F0 and F7 itself)."""
+    from mido import Message
+
+    return Message('sysex', data=build_sysex(command, payload, device)[1:-1])
+
+
+def is_reply(message, command, device=DEVICE):
+    """True if a mido message is a SysEx from the given device for the given command."""
+    if message.type != 'sysex':
+        return False
+    data = message.data
+    return (len(data) >= 4 and data[0] == MANUFACTURER and data[1] == MODEL
+            and data[2] == device and data[3] == command)
+
+
+def masks_from_states(checkbox_states):
+    """Build the 17 channel masks (bit n = output n + 1) from the 8 x 17 checkbox states."""
+    enabled_outputs = [0] * NBR_CHANNELS
+    for channel in range(NBR_CHANNELS):   # 16 channels + RT
+        for output in range(NBR_OUTPUTS):
+            if checkbox_states[output][channel]:
+                enabled_outputs[channel] |= (1 << output)
+    return enabled_outputs
+
+
+def states_from_masks(enabled_outputs):
+    """Inverse of masks_from_states()."""
+    return [[bool(enabled_outputs[channel] & (1 << output)) for channel in range(NBR_CHANNELS)]
+            for output in range(NBR_OUTPUTS)]
+
+
+def encode_routing(enabled_outputs):
+    """Pack the 17 channel masks into the 20 bytes payload of COMMAND_WRITE_TO_DEVICE."""
+    return list(sysex7bit.pack(enabled_outputs))
+
+
+def decode_routing(packed_message):
+    """Unpack the 20 bytes payload of a COMMAND_READ_FROM_DEVICE reply into 17 channel masks."""
+    if len(packed_message) < ROUTING_PACKED_SIZE:
+        raise ValueError(f"routing payload too short: {len(packed_message)} bytes")
+    return list(sysex7bit.unpack(bytes(packed_message[:ROUTING_PACKED_SIZE])))
+
+
+def encode_channels(changed_outputs):
+    """Pack {channel: enabled outputs} into the payload of COMMAND_WRITE_CHANNELS."""
+    pairs = bytearray()
+    for channel, enabled_outputs in sorted(changed_outputs.items()):
+        pairs += bytes((channel, enabled_outputs))
+    return list(sysex7bit.pack(pairs))
+
+
+def decode_channels(packed_message):
+    """Inverse of encode_channels()."""
+    pairs = sysex7bit.unpack(bytes(packed_message))
+    return {pairs[i]: pairs[i + 1] for i in range(0, len(pairs) - 1, 2) if pairs[i] < NBR_CHANNELS}
+
+
+def encode_int7(value, size):
+    """Encode an unsigned integer as size 7-bit bytes, most significant first."""
+    return [(value >> (7 * (size - 1 - i))) & 0x7F for i in range(size)]
+
+
+def decode_int7(data):
+    """Inverse of encode_int7()."""
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7F)
+    return value
+
+
+def convert_to_7bit_message(byte_message, packed_message):
+    """Pack byte_message into the pre-sized packed_message list (kept for older callers, see sysex7bit.pack())."""
+    packed_message[:] = sysex7bit.pack(byte_message)
+
+
+def convert_from_7bit_message(packed_message):
+    """Inverse of convert_to_7bit_message(): return the list of 8-bit bytes."""
+    return list(sysex7bit.unpack(packed_message))
+
+
+class SysexClient:
+    """
+    Request/response engine on top of a PortPool.
+
+    Replies are matched by MANUFACTURER/MODEL/DEVICE/command in the input
+    port callback (backend thread); request() blocks the calling thread only,
+    request_async() queues the whole exchange on a worker thread, so that
+    jobs reach the device in the order they were requested.
+    """
+
+    def __init__(self, port_pool, timeout=0.5, retries=2):
+        self.port_pool = port_pool
+        self.timeout = timeout
+        self.retries = retries
+        self._jobs = queue.SimpleQueue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def request(self, command, payload=(), device=DEVICE, timeout=None, retries=None, reply_device=None):
+        """Send a command and wait for the matching reply. Return the reply payload (after the header)."""
+        with self.port_pool.instrumentation.phase("frame_build"):
+            message = build_message(command, payload, device)
+        return self.exchange(message, timeout, retries, reply_device)
+
+    def exchange(self, message, timeout=None, retries=None, reply_device=None):
+        """
+        Send an already built SysEx message (see build_message()) and wait for the
+        reply matching its command. Return the reply payload (after the header).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        device, command = message.data[2], message.data[3]
+        reply_device = device if reply_device is None else reply_device
+
+        answered = threading.Event()
+        reply = []
+
+        def on_message(message):
+            if not answered.is_set() and is_reply(message, command, reply_device):
+                reply.extend(message.data[4:])
+                answered.set()
+
+        instrumentation = self.port_pool.instrumentation
+        self.port_pool.prepare_exchange()
+        self.port_pool.add_listener(on_message)     # listen before sending, the reply can be fast
+        try:
+            # retries + 1 attempts; when there are retries, the last one is made on a reopened input
+            # (the interface may have been unplugged/replugged)
+            for attempt in range(retries + 1):
+                if attempt and attempt == retries:
+                    self.port_pool.reconnect_input()
+                sent_at = time.perf_counter()
+                self.port_pool.send(message)
+                if answered.wait(timeout):
+                    rtt = time.perf_counter() - sent_at
+                    instrumentation.record_phase("reply_wait", rtt)
+                    instrumentation.record_latency(reply_device, rtt)
+                    return reply
+                instrumentation.count("timeouts")
+        finally:
+            self.port_pool.remove_listener(on_message)
+
+        raise SysexTimeout(f"no answer from device {device:02X} to command {command:02X} "
+                           f"after {retries + 1} attempt(s)")
+
+    def request_async(self, function, on_done, on_error):
+        """
+        Queue function(self) on the worker thread of this client, then call
+        on_done(result) or on_error(exception) from it. Jobs run one at a time,
+        in order.
+        """
+        self._jobs.put((function, on_done, on_error))
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run_jobs, daemon=True)
+                self._worker.start()
+
+    def _run_jobs(self):
+        while True:
+            function, on_done, on_error = self._jobs.get()
+            try:
+                result = function(self)
+            except Exception as e:
+                on_error(e)
+            else:
+                on_done(result)
+
+    def collect(self, command, payload=(), device=DEVICE_BROADCAST, window=None):
+        """Send a command once and gather every matching reply during window seconds: {device ID: payload}."""
+        window = self.timeout if window is None else window
+        replies = {}
+
+        def on_message(message):
+            data = message.data
+            if message.type == 'sysex' and len(data) >= 4 and data[0] == MANUFACTURER \
+                    and data[1] == MODEL and data[3] == command and data[2] != DEVICE_BROADCAST:
+                replies[data[2]] = list(data[4:])
+
+        message = build_message(command, payload, device)
+        self.port_pool.prepare_exchange()
+        self.port_pool.add_listener(on_message)
+        try:
+            self.port_pool.send(message)
+            threading.Event().wait(window)
+        finally:
+            self.port_pool.remove_listener(on_message)
+        return replies
+
+    def ping(self, device=DEVICE):
+        self.request(COMMAND_PING_DEVICE, device=device)
+
+    def discover(self, window=None):
+        """Return the sorted IDs of every device answering a broadcast ping on this port pair."""
+        return sorted(self.collect(COMMAND_PING_DEVICE, window=window))
+
+    def write_routing(self, enabled_outputs, device=DEVICE):
+        """Write the 17 channel masks and wait for the device acknowledge."""
+        self.request(COMMAND_WRITE_TO_DEVICE, encode_routing(enabled_outputs), device=device)
+
+    def write_channels(self, changed_outputs, device=DEVICE):
+        """Write only the given channels ({channel: enabled outputs}) and wait for the device acknowledge."""
+        self.request(COMMAND_WRITE_CHANNELS, encode_channels(changed_outputs), device=device)
+
+    def change_device_id(self, device, new_device):
+        """
+        Give a new ID to a device, the acknowledge comes from the new ID. A lost
+        acknowledge is not resent blindly: the new ID is pinged first, and the
+        change is sent again only if nothing answers there.
+        """
+        if not 0 <= new_device < DEVICE_BROADCAST:
+            raise ValueError(f"invalid device ID: {new_device:02X}")
+        for _ in range(self.retries + 1):
+            try:
+                self.request(COMMAND_CHANGE_DEVICE_ID, [new_device], device=device, reply_device=new_device,
+                             retries=0)
+                return
+            except SysexTimeout:
+                pass
+            try:
+                self.request(COMMAND_PING_DEVICE, device=new_device, retries=0)
+                return                              # applied, only the acknowledge was lost
+            except SysexTimeout:
+                pass
+        raise SysexTimeout(f"device {device:02X} did not move to ID {new_device:02X} "
+                           f"after {self.retries + 1} attempt(s)")
+
+    def read_routing(self, device=DEVICE):
+        """Return the 17 channel masks stored in the device."""
+        return decode_routing(self.request(COMMAND_READ_FROM_DEVICE, device=device))
@@ -0,0 +1,176 @@
+"""
+Software router: the host stands in for a MIDI 1-8 unit being serviced.
+
+Messages of the input port are routed like the firmware does (channel
+messages to the outputs of their channel, system messages to the outputs of
+the RT column) to up to 8 output ports, virtual or physical.
+
+The routing is compiled into a dispatch table indexed by status byte (256
+entries, the channel is the low nibble): routing a message is one lookup
+and one queue put per destination, on the MIDI backend thread. Every output
+has its own queue and writer thread, so a slow or blocked port only delays
+its own messages, unlike the firmware which waits for each message to be
+fully sent (Serial.flush()) before reading the next one. The same message
+object is forwarded to every output, never copied.
+
+Queue depth and latency (input callback to end of send) are measured per
+output.
+"""
+import queue
+import threading
+import time
+from collections import deque
+
+from protocol import NBR_OUTPUTS
+from routing_matrix import FIRMWARE_DEFAULT_ROUTING, output_mask
+from instrumentation import percentile
+
+VIRTUAL_PORT_NAME = "MIDI 1-8 out {}"       # virtual output names, numbered from 1
+
+# mido message types that go on the wire
+CHANNEL_MESSAGE_TYPES = ("note_off", "note_on", "polytouch", "control_change", "program_change", "aftertouch",
+                         "pitchwheel")
+SYSTEM_MESSAGE_TYPES = ("sysex", "quarter_frame", "songpos", "song_select", "tune_request",
+                        "clock", "start", "continue", "stop", "active_sensing", "reset")
+
+
+def open_outputs(names, open_output=None, virtual=False):
+    """
+    Open up to NBR_OUTPUTS output ports by name (None or "" leaves an output
+    unconnected). virtual: create the ports instead (not supported on Windows).
+    """
+    if open_output is None:
+        from mido import open_output
+
+    ports = []
+    try:
+        for name in names:
+            if not name:
+                ports.append(None)
+            elif virtual:
+                ports.append(open_output(name, virtual=True))
+            else:
+                ports.append(open_output(name))
+    except Exception:
+        for port in ports:
+            if port is not None:
+                port.close()
+        raise
+    return ports
+
+
+class OutputQueue:
+    """Queue and writer thread of one output port, with its statistics."""
+
+    def __init__(self, output, port, window=1000):
+        self.output = output
+        self.port = port
+        self.queue = queue.SimpleQueue()
+        self.forwarded = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.latencies = deque(maxlen=window)   # seconds, input callback to end of send
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            depth = self.queue.qsize() + 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+            message, received_at = item
+            try:
+                self.port.send(message)
+            except Exception:
+                self.errors += 1
+                continue
+            self.latencies.append(time.perf_counter() - received_at)
+            self.forwarded += 1
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join(1.0)
+
+    def stats(self):
+        latencies = list(self.latencies)
+        return {
+            "output": self.output + 1,
+            "port": getattr(self.port, "name", None),
+            "forwarded": self.forwarded,
+            "errors": self.errors,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else None,
+            "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+            "max_ms": max(latencies) * 1000 if latencies else None,
+        }
+
+
+class SoftwareRouter:
+    """Route incoming messages to output ports through a status byte dispatch table."""
+
+    def __init__(self, output_ports, enabled_outputs=FIRMWARE_DEFAULT_ROUTING, window=1000):
+        from mido import Message
+
+        if len(output_ports) > NBR_OUTPUTS:
+            raise ValueError(f"at most {NBR_OUTPUTS} output ports")
+        # status byte of each message type (channel messages: of channel 1)
+        self._status_by_type = {name: Message(name).bytes()[0]
+                                for name in CHANNEL_MESSAGE_TYPES + SYSTEM_MESSAGE_TYPES}
+        self.outputs = [OutputQueue(output, port, window) if port is not None else None
+                        for output, port in enumerate(output_ports)]
+        self.received = 0
+        self.unrouted = 0
+        self.set_routing(enabled_outputs)
+
+    def set_routing(self, enabled_outputs):
+        """Compile the 17 channel masks into the dispatch table (can be called while routing)."""
+        table = []
+        for status in range(256):
+            mask = output_mask(status, enabled_outputs) if status >= 0x80 else 0
+            table.append(tuple(output.queue for output in self.outputs
+                               if output is not None and mask & (1 << output.output)))
+        self._table = table                     # replaced as a whole, the input thread never sees a partial table
+
+    def on_message(self, message):
+        """Input callback (MIDI backend thread): queue the message on its outputs."""
+        received_at = time.perf_counter()
+        self.received += 1
+        status = self._status_by_type[message.type]
+        if status < 0xF0:
+            status |= message.channel
+        destinations = self._table[status]
+        if not destinations:
+            self.unrouted += 1
+            return
+        item = (message, received_at)
+        for output_queue in destinations:
+            output_queue.put(item)
+
+    def stats(self):
+        """Statistics of each connected output."""
+        return [output.stats() for output in self.outputs if output is not None]
+
+    def close(self):
+        """Stop the writer threads (after the queued messages are sent) and close the output ports."""
+        for output in self.outputs:
+            if output is not None:
+                output.stop()
+                output.port.close()
+
+
+def format_stats(router):
+    lines = [f"received {router.received}, routed nowhere {router.unrouted}"]
+    for stats in router.stats():
+        line = (f"  output {stats['output']} ({stats['port']}): {stats['forwarded']} forwarded,"
+                f" queue {stats['queue_depth']} (max {stats['max_queue_depth']})")
+        if stats["p50_ms"] is not None:
+            line += (f", latency p50 {stats['p50_ms']:.3f} ms, p99 {stats['p99_ms']:.3f} ms,"
+                     f" max {stats['max_ms']:.3f} ms")
+        if stats["errors"]:
+            line += f", {stats['errors']} send errors"
+        lines.append(line)
+    return "\n".join(lines)
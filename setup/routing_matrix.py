@@ -0,0 +1,169 @@
+"""
+Routing matrix model: 8 outputs x 17 channels (16 MIDI channels + RT).
+
+The matrix is stored as it goes on the wire: 17 bytes, one per channel,
+bit n set when output n + 1 is enabled. Row operations are done with
+bytes.translate() tables (one C call for the 17 channels), column and
+whole-matrix operations are single byte/slice assignments.
+
+Listeners are called once per edit, and only once for all the edits made
+inside a batch() block.
+"""
+from contextlib import contextmanager
+
+import sysex7bit
+from protocol import NBR_OUTPUTS, NBR_CHANNELS
+
+ALL_OUTPUTS = (1 << NBR_OUTPUTS) - 1
+RT_CHANNEL  = NBR_CHANNELS - 1          # last column: system (realtime, common, exclusive) messages
+
+# routing of the original "one output per MIDI channel" firmware:
+# channel n to output n (channels 9 to 16 are dropped), system messages to every output
+FIRMWARE_DEFAULT_ROUTING = bytes([1 << channel for channel in range(NBR_OUTPUTS)]
+                                 + [0] * (RT_CHANNEL - NBR_OUTPUTS) + [ALL_OUTPUTS])
+
+# per output: tables setting / clearing its bit in every channel mask
+_SET_OUTPUT   = [bytes(b | (1 << output) for b in range(256)) for output in range(NBR_OUTPUTS)]
+_CLEAR_OUTPUT = [bytes(b & ~(1 << output) for b in range(256)) for output in range(NBR_OUTPUTS)]
+_INVERT       = bytes(b ^ ALL_OUTPUTS for b in range(256))
+
+
+def output_mask(status, enabled_outputs):
+    """Outputs (bit n = output n + 1) receiving a message, from its status byte, as the firmware does."""
+    if status >= 0xF0:
+        return enabled_outputs[RT_CHANNEL]      # system message
+    return enabled_outputs[status & 0x0F]       # channel message
+
+
+class RoutingMatrix:
+    """Compact 8 x 17 routing matrix, backed by the 17 channel masks."""
+
+    def __init__(self, enabled_outputs=None):
+        self._masks = bytearray(NBR_CHANNELS)
+        self._listeners = []
+        self._batch_depth = 0
+        self._changed = False
+        if enabled_outputs is not None:
+            self._masks[:] = bytes(enabled_outputs)
+
+    # ---- change notification ----
+
+    def add_listener(self, listener):
+        """listener(matrix) is called after each edit, or once at the end of a batch."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    @contextmanager
+    def batch(self):
+        """Coalesce every edit made in the block into a single notification."""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._changed:
+                self._notify()
+
+    def _update(self, masks):
+        if masks != self._masks:
+            self._masks[:] = masks
+            self._changed = True
+        if self._batch_depth == 0 and self._changed:
+            self._notify()
+
+    def _notify(self):
+        self._changed = False
+        for listener in self._listeners:
+            listener(self)
+
+    # ---- read access ----
+
+    def get(self, output, channel):
+        return bool(self._masks[channel] & (1 << output))
+
+    def masks(self):
+        """The 17 channel masks (wire order), as bytes."""
+        return bytes(self._masks)
+
+    def row(self, output):
+        """States of the 17 channels of an output."""
+        return [bool(mask & (1 << output)) for mask in self._masks]
+
+    def to_states(self):
+        """8 x 17 list of bools (same layout as the GUI grid)."""
+        return [self.row(output) for output in range(NBR_OUTPUTS)]
+
+    def encode(self):
+        """7-bit packed payload of COMMAND_WRITE_TO_DEVICE."""
+        return sysex7bit.pack(self._masks)
+
+    def __eq__(self, other):
+        return isinstance(other, RoutingMatrix) and self._masks == other._masks
+
+    # ---- edits ----
+
+    def set(self, output, channel, state):
+        masks = bytearray(self._masks)
+        if state:
+            masks[channel] |= (1 << output)
+        else:
+            masks[channel] &= ~(1 << output)
+        self._update(masks)
+
+    def set_masks(self, enabled_outputs):
+        """Replace the whole matrix with 17 channel masks (e.g. read from the device)."""
+        masks = bytes(enabled_outputs)
+        if len(masks) != NBR_CHANNELS:
+            raise ValueError(f"expected {NBR_CHANNELS} channel masks, got {len(masks)}")
+        self._update(masks)
+
+    def set_states(self, checkbox_states):
+        """Replace the whole matrix with an 8 x 17 list of bools."""
+        masks = bytearray(NBR_CHANNELS)
+        for output, row in enumerate(checkbox_states):
+            for channel, state in enumerate(row):
+                if state:
+                    masks[channel] |= (1 << output)
+        self._update(masks)
+
+    def set_row(self, output, state):
+        """Enable (or disable) every channel of an output."""
+        table = _SET_OUTPUT[output] if state else _CLEAR_OUTPUT[output]
+        self._update(self._masks.translate(table))
+
+    def set_column(self, channel, state):
+        """Send a channel to every output (or to none)."""
+        masks = bytearray(self._masks)
+        masks[channel] = ALL_OUTPUTS if state else 0
+        self._update(masks)
+
+    def set_all(self, state):
+        self._update(bytes([ALL_OUTPUTS if state else 0]) * NBR_CHANNELS)
+
+    def invert(self):
+        self._update(self._masks.translate(_INVERT))
+
+    def copy_row(self, source_output, destination_output):
+        """Give destination_output the same channels as source_output."""
+        masks = self._masks.translate(_CLEAR_OUTPUT[destination_output])
+        shift = destination_output - source_output
+        for channel, mask in enumerate(self._masks):
+            bit = mask & (1 << source_output)
+            masks[channel] |= (bit << shift) if shift >= 0 else (bit >> -shift)
+        self._update(masks)
+
+    def transpose(self):
+        """
+        Transpose the square part of the matrix (channels 1 to 8 x outputs 1 to 8):
+        "channel n goes to output m" becomes "channel m goes to output n".
+        Channels 9 to 16 and RT are left unchanged.
+        """
+        masks = bytearray(self._masks)
+        for channel in range(NBR_OUTPUTS):
+            masks[channel] = 0
+            for output in range(NBR_OUTPUTS):
+                if self._masks[output] & (1 << channel):
+                    masks[channel] |= (1 << output)
+        self._update(masks)
@@ -0,0 +1,130 @@
+"""
+Scene switching: routings recalled by MIDI triggers (Program Change or note)
+sent by a show controller, without anybody clicking "Send".
+
+Every scene is compiled ahead of time into its final COMMAND_WRITE_TO_DEVICE
+message, and the triggers are looked up in a flat table indexed by status
+byte and first data byte. The input callback does one lookup and one send on
+the already open output: no packing, no frame built per trigger. The time
+from the callback entry to the end of the send is recorded for every trigger.
+
+Triggers are written "program:CHANNEL:NUMBER" or "note:CHANNEL:NUMBER",
+channels 1 to 16, numbers 0 to 127 (a note triggers on note on only).
+"""
+import json
+import threading
+import time
+from collections import deque, namedtuple
+
+from protocol import DEVICE, COMMAND_WRITE_TO_DEVICE, build_message, encode_routing
+from instrumentation import percentile
+
+TRIGGER_STATUS = {"program": 0xC0, "note": 0x90}
+
+# a compiled scene: trigger text, scene name and the message to send
+Scene = namedtuple("Scene", "trigger name frame")
+
+
+def parse_trigger(text):
+    """Table index of a trigger written "program:CHANNEL:NUMBER" or "note:CHANNEL:NUMBER"."""
+    try:
+        kind, channel, number = text.split(":")
+        status = TRIGGER_STATUS[kind.strip().lower()]
+        channel, number = int(channel), int(number)
+    except (KeyError, ValueError):
+        raise ValueError(f"invalid trigger {text!r}, expected program:CHANNEL:NUMBER or note:CHANNEL:NUMBER")
+    if not 1 <= channel <= 16 or not 0 <= number <= 127:
+        raise ValueError(f"invalid trigger {text!r}: channel 1 to 16, number 0 to 127")
+    return ((status | (channel - 1)) << 7) | number
+
+
+def load_scene_map(file_name):
+    """Read a scene map: a JSON object of trigger -> preset name."""
+    with open(file_name) as f:
+        scene_map = json.load(f)
+    if not isinstance(scene_map, dict):
+        raise ValueError(f"{file_name}: expected an object of trigger -> preset name")
+    return scene_map
+
+
+class SceneEngine:
+    """Fire precompiled routing writes on trigger messages received by a port pool."""
+
+    def __init__(self, port_pool, device=DEVICE, on_fired=None, window=1000):
+        self.port_pool = port_pool
+        self.device = device
+        self.on_fired = on_fired                # optional on_fired(scene, seconds), after the send
+        self._table = [None] * (256 << 7)       # (status << 7 | first data byte) -> Scene
+        self._lock = threading.Lock()
+        self.armed = False
+        self.fired = 0
+        self.latencies = deque(maxlen=window)   # trigger to send, seconds
+
+    # ---- trigger table ----
+
+    def add(self, trigger, name, enabled_outputs):
+        """Compile the 17 channel masks of a scene and map a trigger to it."""
+        frame = build_message(COMMAND_WRITE_TO_DEVICE, encode_routing(enabled_outputs), self.device)
+        self._table[parse_trigger(trigger)] = Scene(trigger, name, frame)
+
+    def add_preset(self, trigger, library, name):
+        """Map a trigger to a preset of a PresetLibrary (its cached frame is used)."""
+        if name not in library:
+            raise KeyError(f"no preset named {name!r}")
+        self._table[parse_trigger(trigger)] = Scene(trigger, name, library.frame(name, self.device))
+
+    def remove(self, trigger):
+        self._table[parse_trigger(trigger)] = None
+
+    def scenes(self):
+        return [scene for scene in self._table if scene is not None]
+
+    # ---- run ----
+
+    def arm(self):
+        """Open the output and the input now, so that the first trigger does not pay for it."""
+        with self._lock:
+            self.port_pool.output()
+            self.port_pool.listen()
+            self.port_pool.add_listener(self.on_message)
+            self.armed = True
+
+    def disarm(self):
+        with self._lock:
+            self.port_pool.remove_listener(self.on_message)
+            self.armed = False
+
+    def on_message(self, message):
+        """Input callback (MIDI backend thread): send the scene of a trigger message."""
+        received_at = time.perf_counter()
+        kind = message.type
+        if kind == 'program_change':
+            index = ((0xC0 | message.channel) << 7) | message.program
+        elif kind == 'note_on' and message.velocity:
+            index = ((0x90 | message.channel) << 7) | message.note
+        else:
+            return
+
+        scene = self._table[index]
+        if scene is None:
+            return
+        self.port_pool.send(scene.frame)
+        elapsed = time.perf_counter() - received_at
+
+        self.fired += 1
+        self.latencies.append(elapsed)
+        self.port_pool.instrumentation.record_phase("trigger_to_send", elapsed)
+        if self.on_fired is not None:
+            self.on_fired(scene, elapsed)
+
+    def stats(self):
+        """Triggers fired and trigger to send latency percentiles, in milliseconds."""
+        latencies = list(self.latencies)
+        if not latencies:
+            return {"fired": self.fired, "p50_ms": None, "p99_ms": None, "max_ms": None}
+        return {
+            "fired": self.fired,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": max(latencies) * 1000,
+        }
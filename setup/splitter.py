@@ -0,0 +1,188 @@
+"""
+Offline splitter: render MIDI files into what each of the 8 outputs would emit.
+
+The routing rules are the firmware ones (routing_matrix.output_mask): channel
+messages go to the outputs enabled for their channel, system messages
+(SysEx) to the outputs enabled in the RT column. Meta messages (tempo, time
+signature, names, end of track) are not sent on the wire but are kept on
+every output, so each file plays with the original timing; the delta time
+of a message routed away from an output is carried to the next one.
+
+Files are streamed one track at a time: a track is read, split into the 8
+outputs and written right away, so only one input track is in memory
+whatever the file size. This uses mido's track reader/writer
+(mido.midifiles.midifiles), which is not part of the documented API: when
+the installed mido does not have it, whole files are loaded with MidiFile()
+instead. Directories are split in parallel, one file per process.
+
+    song.mid -> OUT_DIR/song_out1.mid ... OUT_DIR/song_out8.mid
+"""
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from protocol import NBR_OUTPUTS
+from routing_matrix import output_mask
+from load_analyzer import midi_files
+
+
+def output_file_names(file_name, out_dir, root=None):
+    """The 8 file names of a split file, keeping its path relative to root."""
+    relative = os.path.relpath(file_name, root) if root else os.path.basename(file_name)
+    stem = os.path.splitext(relative)[0]
+    return [os.path.join(out_dir, f"{stem}_out{output + 1}.mid") for output in range(NBR_OUTPUTS)]
+
+
+def split_track(track, enabled_outputs):
+    """Split one MidiTrack into NBR_OUTPUTS MidiTracks. Return (tracks, routed message count per output)."""
+    from mido import MidiTrack
+
+    tracks = [MidiTrack() for _ in range(NBR_OUTPUTS)]
+    pending = [0] * NBR_OUTPUTS                 # ticks of the messages routed away from each output
+    counts = [0] * NBR_OUTPUTS
+    all_outputs = (1 << NBR_OUTPUTS) - 1
+
+    for message in track:
+        if message.is_meta:
+            mask = all_outputs
+        else:
+            mask = output_mask(0xF0 if message.type == 'sysex' else message.bytes()[0], enabled_outputs)
+
+        for output in range(NBR_OUTPUTS):
+            if mask & (1 << output):
+                delta = pending[output] + message.time
+                # messages are shared between the outputs, copied only when their delta changes
+                tracks[output].append(message if delta == message.time else message.copy(time=delta))
+                pending[output] = 0
+                if not message.is_meta:
+                    counts[output] += 1
+            else:
+                pending[output] += message.time
+    return tracks, counts
+
+
+def _track_io():
+    """mido's track reader/writer functions, or None if this mido version does not have them."""
+    try:
+        from mido.midifiles.meta import meta_charset
+        from mido.midifiles.midifiles import read_file_header, read_track, write_chunk, write_track
+    except ImportError:
+        return None
+    return meta_charset, read_file_header, read_track, write_chunk, write_track
+
+
+def streaming_available():
+    return _track_io() is not None
+
+
+def _split_whole_file(file_name, enabled_outputs, out_names):
+    """Fallback of split_file() loading the whole file. Return (message count, routed count per output)."""
+    from mido import MidiFile
+
+    midi_file = MidiFile(file_name)
+    outputs = [MidiFile(type=midi_file.type, ticks_per_beat=midi_file.ticks_per_beat) for _ in out_names]
+    messages = 0
+    counts = [0] * NBR_OUTPUTS
+    for track in midi_file.tracks:
+        messages += len(track)
+        tracks, track_counts = split_track(track, enabled_outputs)
+        for output_file, output_track in zip(outputs, tracks):
+            output_file.tracks.append(output_track)
+        for output, count in enumerate(track_counts):
+            counts[output] += count
+    for output_file, name in zip(outputs, out_names):
+        output_file.save(name)
+    return messages, counts
+
+
+def _split_streaming(file_name, enabled_outputs, out_names, track_io):
+    """Split a file one track at a time. Return (message count, routed count per output)."""
+    meta_charset, read_file_header, read_track, write_chunk, write_track = track_io
+    messages = 0
+    counts = [0] * NBR_OUTPUTS
+
+    outputs = []
+    try:
+        with open(file_name, "rb") as infile, meta_charset('latin1'):
+            file_type, track_count, ticks_per_beat = read_file_header(infile)
+            outputs = [open(name, "wb") for name in out_names]
+            header = struct.pack('>hhh', file_type, track_count, ticks_per_beat)
+            for outfile in outputs:
+                write_chunk(outfile, b'MThd', header)
+
+            for _ in range(track_count):
+                track = read_track(infile)
+                messages += len(track)
+                tracks, track_counts = split_track(track, enabled_outputs)
+                for outfile, output_track in zip(outputs, tracks):
+                    write_track(outfile, output_track)
+                for output, count in enumerate(track_counts):
+                    counts[output] += count
+    finally:
+        for outfile in outputs:
+            outfile.close()
+    return messages, counts
+
+
+def split_file(file_name, enabled_outputs, out_names):
+    """Split one MIDI file into the out_names files (one per output). Return a dict report."""
+    enabled_outputs = bytes(enabled_outputs)
+    start = time.perf_counter()
+
+    for name in out_names:
+        os.makedirs(os.path.dirname(name) or ".", exist_ok=True)
+
+    track_io = _track_io()
+    if track_io is None:
+        messages, counts = _split_whole_file(file_name, enabled_outputs, out_names)
+    else:
+        messages, counts = _split_streaming(file_name, enabled_outputs, out_names, track_io)
+
+    return {
+        "file": file_name,
+        "bytes": os.path.getsize(file_name),
+        "messages": messages,
+        "outputs": counts,
+        "out_files": list(out_names),
+        "duration_s": time.perf_counter() - start,
+    }
+
+
+def _split_file_safe(job):
+    file_name, enabled_outputs, out_names = job
+    try:
+        return split_file(file_name, enabled_outputs, out_names)
+    except Exception as e:
+        return {"file": file_name, "error": str(e)}
+
+
+def split(paths, enabled_outputs, out_dir, jobs=None):
+    """
+    Split files and directories (recursively) into out_dir, in parallel.
+    Yield one report per file, in order.
+    """
+    file_names = list(midi_files(paths))
+    root = None
+    if len(file_names) > 1:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(name)) for name in file_names])
+    job_list = [(name, bytes(enabled_outputs), output_file_names(os.path.abspath(name), out_dir, root))
+                for name in file_names]
+
+    if len(job_list) <= 1 or jobs == 1:
+        yield from map(_split_file_safe, job_list)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(_split_file_safe, job_list, chunksize=4)
+
+
+def format_summary(reports, elapsed):
+    """Throughput summary of a split run."""
+    done = [report for report in reports if "error" not in report]
+    total_bytes = sum(report["bytes"] for report in done)
+    total_messages = sum(report["messages"] for report in done)
+    elapsed = max(elapsed, 1e-9)
+    return (f"{len(done)} file(s) split, {len(reports) - len(done)} failed, {total_messages} messages,"
+            f" {total_bytes / 1e6:.1f} MB in {elapsed:.2f} s"
+            f" ({len(done) / elapsed:.1f} files/s, {total_messages / elapsed:.0f} messages/s,"
+            f" {total_bytes / 1e6 / elapsed:.2f} MB/s)")
@@ -0,0 +1,141 @@
+"""
+7-bit SysEx codec.
+
+SysEx data bytes must keep their MSB cleared, so 8-bit payloads are sent as
+groups of up to 7 bytes, each group being preceded by a "carry" byte
+collecting the MSBs of the group (1st byte of the group is the carry's bit 6):
+
+    <0 b1[7] b2[7] b3[7] b4[7] b5[7] b6[7] b7[7]>,
+    <0 b1[0..6]>, <0 b2[0..6]>, ... <0 b7[0..6]>,
+    <next carry>, ...
+
+A carry is always written after the last full group, so a payload of n bytes
+is packed into n + n // 7 + 1 bytes (17 routing bytes -> 20).
+
+The work is done with bytes.translate() tables, one integer multiplication
+for all the carries and extended slices rather than one Python iteration per
+byte. Below a few groups, the setup of those costs more than it saves:
+payloads shorter than _GROUP_LOOP_SIZE are built one group at a time, and
+the shortest ones with a plain byte loop. pack_many() uses NumPy when
+installed.
+"""
+
+# low 7 bits of every byte value
+_LOW_7_BITS = bytes(b & 0x7F for b in range(256))
+# carry byte -> the 7 MSBs (0x80 or 0x00) it holds, first byte of the group first
+_CARRY_TO_MSBS = [bytes(((c << (k + 1)) & 0x80) for k in range(7)) for c in range(128)]
+# 7 bytes of 0 / 1 read as a big-endian integer, times this, have their 7 bits side by side at bits 42 to 48
+_GATHER_7 = sum(1 << (7 * k) for k in range(7))
+
+_BYTE_LOOP_SIZE = 10            # payloads shorter than this are packed with a byte loop
+_GROUP_LOOP_SIZE = 128          # ... than this one group at a time, the longer ones with slices
+
+
+def packed_size(size):
+    """Number of 7-bit bytes needed to send size 8-bit bytes."""
+    return size + size // 7 + 1
+
+
+def unpacked_size(size):
+    """Number of 8-bit bytes carried by size 7-bit bytes."""
+    return size - (size + 7) // 8
+
+
+def _as_bytes(data):
+    if isinstance(data, bytes):
+        return data
+    return bytes(data)              # bytearray, memoryview, list of ints...
+
+
+def _carries(data, groups):
+    """The carry bytes of data, split into groups of 7 bytes (the last one padded with zeros)."""
+    # data as one integer, padded on the right and shifted so that every MSB becomes bit 0 of its byte
+    padded = int.from_bytes(data, 'big') << (8 * (7 * groups - len(data)) - 7)
+    msbs = padded & int.from_bytes(b'\x01' * (7 * groups), 'big')
+    # every group gets its carry in the 7th byte of its own 7 bytes: the product terms
+    # never overlap (nothing carries over) and never reach the MSB of that byte
+    return ((msbs * _GATHER_7) >> 42).to_bytes(7 * groups, 'big')[6::7]
+
+
+def _pack_bytes(data):
+    packed = bytearray(packed_size(len(data)))
+    carry, carry_index, index, position = 0, 0, 1, 0
+    for byte in data:
+        packed[index] = byte & 0x7F
+        index += 1
+        carry |= (byte & 0x80) >> position + 1
+        position += 1
+        if position == 7:
+            packed[carry_index] = carry
+            carry, carry_index, position = 0, index, 0
+            index += 1
+    packed[carry_index] = carry
+    return bytes(packed)
+
+
+def pack(data):
+    """Pack 8-bit data (bytes, bytearray, memoryview or iterable of ints) into 7-bit bytes."""
+    data = _as_bytes(data)
+    size = len(data)
+    if size < _BYTE_LOOP_SIZE:
+        return _pack_bytes(data)
+
+    groups = size // 7 + 1
+    carries = _carries(data, groups)
+    low = data.translate(_LOW_7_BITS)
+    if size < _GROUP_LOOP_SIZE:
+        packed = bytearray()
+        for group in range(groups):
+            packed.append(carries[group])
+            packed += low[7 * group:7 * group + 7]
+        return bytes(packed)
+
+    packed = bytearray(size + groups)
+    packed[0::8] = carries
+    for k in range(7):
+        packed[1 + k::8] = low[k::7]
+    return bytes(packed)
+
+
+def unpack(packed):
+    """Inverse of pack(): return the 8-bit bytes carried by the 7-bit packed data."""
+    packed = _as_bytes(packed)
+    size = unpacked_size(len(packed))
+    if size <= 0:
+        return b''
+
+    low = bytearray(size)
+    for k in range(7):
+        low[k::7] = packed[1 + k::8]
+
+    msbs = b''.join([_CARRY_TO_MSBS[carry & 0x7F] for carry in packed[0::8]])[:size]
+    return (int.from_bytes(low, 'big') | int.from_bytes(msbs, 'big')).to_bytes(size, 'big')
+
+
+def pack_many(payloads):
+    """Pack many payloads at once (e.g. a bank of routing matrices). Return a list of bytes."""
+    payloads = [_as_bytes(payload) for payload in payloads]
+    sizes = {len(payload) for payload in payloads}
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is None or len(sizes) != 1 or len(payloads) < 2:
+        return [pack(payload) for payload in payloads]
+
+    size = sizes.pop()
+    groups = size // 7 + 1
+
+    data = numpy.zeros((len(payloads), groups * 7), dtype=numpy.uint8)
+    data[:, :size] = numpy.frombuffer(b''.join(payloads), dtype=numpy.uint8).reshape(len(payloads), size)
+    data = data.reshape(len(payloads), groups, 7)
+
+    packed = numpy.empty((len(payloads), groups, 8), dtype=numpy.uint8)
+    packed[:, :, 1:] = data & 0x7F
+    packed[:, :, 0] = ((data >> 7) << numpy.arange(6, -1, -1, dtype=numpy.uint8)).sum(axis=2, dtype=numpy.uint8)
+
+    packed = packed.reshape(len(payloads), groups * 8)[:, :packed_size(size)]
+    return [row.tobytes() for row in packed]
+
@@ -0,0 +1,63 @@
+"""Bulk transfers to emulated units, with lost replies."""
+import os
+
+import pytest
+
+from bulk import BulkError, send_bulk
+from emulator import EmulatedPort
+from protocol import DEVICE
+
+
+@pytest.fixture
+def send(rack, connect):
+    """send(data, target, drop_rate, **options): bulk transfer to a unit on its own link. Return (stats, unit)."""
+    def send(data, target=1, drop_rate=0.0, seed=1, **options):
+        name = f"bulk {len(rack.links)}"
+        link = rack.add(name, EmulatedPort([DEVICE], latency=0.001, drop_rate=drop_rate, seed=seed))
+        client = connect(name)
+        return send_bulk(client.port_pool, data, target, DEVICE, timeout=0.1, **options), link.unit(DEVICE)
+
+    return send
+
+
+@pytest.mark.parametrize("size", [0, 1, 47, 48, 49, 1000])
+def test_transfer(send, size):
+    data = os.urandom(size)
+    stats, unit = send(data, target=3)
+    assert unit.bulk.data[3] == data
+    assert stats["retransmits"] == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_lossy_link(send, seed):
+    data = os.urandom(4000)
+    stats, unit = send(data, drop_rate=0.1, seed=seed, retries=10)
+    assert unit.bulk.data[1] == data
+
+
+def test_chunk_sizes(send):
+    data = os.urandom(500)
+    for chunk_size in (1, 7, 300, 16383):
+        stats, unit = send(data, chunk_size=chunk_size)
+        assert unit.bulk.data[1] == data
+
+
+@pytest.mark.parametrize("options", [{"chunk_size": 0}, {"chunk_size": 16384}, {"target": 128}, {"target": -1}])
+def test_invalid_parameters(send, options):
+    with pytest.raises(ValueError):
+        send(b"data", **options)
+
+
+def test_unanswered_transfer_ids(rack, connect, monkeypatch):
+    rack.add("bulk", EmulatedPort([DEVICE]))
+    client = connect("bulk")
+    unit = rack.links["bulk"].unit(DEVICE)
+    handle = unit.bulk.handle
+
+    def other_transfer(command, payload):
+        reply = handle(command, payload)
+        return None if reply is None else [(reply[0] + 1) & 0x7F] + reply[1:]
+
+    monkeypatch.setattr(unit.bulk, "handle", other_transfer)
+    with pytest.raises(BulkError):
+        send_bulk(client.port_pool, b"data", 1, DEVICE, timeout=0.05, retries=0)
@@ -0,0 +1,82 @@
+"""push_routing() against emulated units: skipped, partial and full writes."""
+import pytest
+
+from device_cache import DeviceStateCache, WRITE_FULL, WRITE_PARTIAL, WRITE_SKIPPED, push_routing
+from emulator import EmulatedDevice, EmulatedPort
+from protocol import COMMAND_WRITE_CHANNELS, DEVICE, SysexTimeout
+from routing_matrix import FIRMWARE_DEFAULT_ROUTING, RT_CHANNEL
+
+
+class FullWriteOnlyDevice(EmulatedDevice):
+    """A unit with an older firmware, not answering COMMAND_WRITE_CHANNELS."""
+
+    def _handle_command(self, command, payload):
+        if command == COMMAND_WRITE_CHANNELS:
+            return None
+        return super()._handle_command(command, payload)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DeviceStateCache(str(tmp_path / "devices.json"))
+
+
+def with_channel(enabled_outputs, channel, enabled):
+    enabled_outputs = bytearray(enabled_outputs)
+    enabled_outputs[channel] = enabled
+    return bytes(enabled_outputs)
+
+
+def test_first_write_is_full(client, link, cache):
+    assert push_routing(client, cache, DEVICE, FIRMWARE_DEFAULT_ROUTING) == WRITE_FULL
+    assert cache.get("link", DEVICE) == list(FIRMWARE_DEFAULT_ROUTING)
+
+
+def test_unchanged_is_skipped(client, link, cache):
+    push_routing(client, cache, DEVICE, FIRMWARE_DEFAULT_ROUTING)
+    received = link.received
+    assert push_routing(client, cache, DEVICE, FIRMWARE_DEFAULT_ROUTING) == WRITE_SKIPPED
+    assert link.received == received
+
+
+def test_few_changes_are_partial(client, link, cache):
+    push_routing(client, cache, DEVICE, FIRMWARE_DEFAULT_ROUTING)
+    routing = with_channel(FIRMWARE_DEFAULT_ROUTING, RT_CHANNEL, 0x01)
+    assert push_routing(client, cache, DEVICE, routing) == WRITE_PARTIAL
+    assert bytes(link.unit(DEVICE).enabled_outputs) == routing
+    assert cache.get("link", DEVICE) == list(routing)
+
+
+def test_many_changes_are_full(client, link, cache):
+    push_routing(client, cache, DEVICE, FIRMWARE_DEFAULT_ROUTING)
+    routing = bytes(mask ^ 0xFF for mask in FIRMWARE_DEFAULT_ROUTING)
+    assert push_routing(client, cache, DEVICE, routing) == WRITE_FULL
+    assert bytes(link.unit(DEVICE).enabled_outputs) == routing
+
+
+def test_force(client, link, cache):
+    push_routing(client, cache, DEVICE, FIRMWARE_DEFAULT_ROUTING)
+    link.unit(DEVICE).enabled_outputs[:] = bytes(17)     # unit reset behind the cache's back
+    assert push_routing(client, cache, DEVICE, FIRMWARE_DEFAULT_ROUTING, force=True) == WRITE_FULL
+    assert bytes(link.unit(DEVICE).enabled_outputs) == FIRMWARE_DEFAULT_ROUTING
+
+
+def test_partial_write_not_supported(rack, connect, cache):
+    link = rack.add("old", EmulatedPort([FullWriteOnlyDevice(DEVICE)]))
+    client = connect("old", retries=0)
+    push_routing(client, cache, DEVICE, FIRMWARE_DEFAULT_ROUTING)
+    routing = with_channel(FIRMWARE_DEFAULT_ROUTING, 3, 0x80)
+    assert push_routing(client, cache, DEVICE, routing) == WRITE_FULL
+    assert bytes(link.unit(DEVICE).enabled_outputs) == routing
+
+
+def test_failed_write_forgets_the_state(client, cache):
+    cache.set("link", DEVICE + 1, FIRMWARE_DEFAULT_ROUTING)   # a unit that has gone since
+    with pytest.raises(SysexTimeout):
+        push_routing(client, cache, DEVICE + 1, with_channel(FIRMWARE_DEFAULT_ROUTING, 0, 0))
+    assert cache.get("link", DEVICE + 1) is None
+
+
+def test_cache_is_persisted(client, cache):
+    push_routing(client, cache, DEVICE, FIRMWARE_DEFAULT_ROUTING)
+    assert DeviceStateCache(cache.file_name).get("link", DEVICE) == list(FIRMWARE_DEFAULT_ROUTING)
@@ -0,0 +1,157 @@
+"""Fleet discovery, push and renumbering against emulated units, and the renumbering planner."""
+import pytest
+
+from emulator import EmulatedPort
+from fleet import Fleet, Unit, _plan_renumbering
+from protocol import DEVICE_BROADCAST, SysexClient, SysexTimeout
+
+
+@pytest.fixture
+def fleet_of(rack):
+    """fleet_of({name: device IDs}, drop_rate): a Fleet on emulated links."""
+    fleets = []
+
+    def fleet_of(chains, drop_rate=0.0, retries=2):
+        for name, devices in chains.items():
+            rack.add(name, EmulatedPort(devices, drop_rate=drop_rate, seed=len(devices)))
+        fleet = Fleet([(name, name) for name in chains], rack.open_output, rack.open_input,
+                      timeout=0.05, retries=retries)
+        fleets.append(fleet)
+        return fleet
+
+    yield fleet_of
+    for fleet in fleets:
+        fleet.close()
+
+
+def devices_of(rack, name):
+    return sorted(unit.device for unit in rack.links[name].units)
+
+
+def unit(device, port="a"):
+    return Unit(port, port, device)
+
+
+# ---- planner ----
+
+def test_plan_simple_moves():
+    steps = _plan_renumbering({unit(1): 3, unit(2): 4}, {1, 2}, {})
+    assert sorted(steps) == [(unit(1), 1, 3), (unit(2), 2, 4)]
+
+
+def test_plan_chain_is_ordered():
+    # 1 -> 2 can only be done once 2 -> 3 has freed ID 2
+    assert _plan_renumbering({unit(1): 2, unit(2): 3}, {1, 2}, {}) == [(unit(2), 2, 3), (unit(1), 1, 2)]
+
+
+def test_plan_cycle_uses_a_spare_id():
+    rejected = {}
+    steps = _plan_renumbering({unit(1): 2, unit(2): 1}, {0, 1, 2}, rejected)
+    assert not rejected
+    assert len(steps) == 3
+    parked, spare = steps[0][0], steps[0][2]
+    assert spare not in (0, 1, 2) and spare < DEVICE_BROADCAST
+    assert steps[-1] == (parked, spare, 2 if parked.device == 1 else 1)
+
+    occupied = {0, 1, 2}
+    for _, device, new_device in steps:
+        assert new_device not in occupied
+        occupied.remove(device)
+        occupied.add(new_device)
+    assert occupied == {0, 1, 2}
+
+
+def test_plan_rejects_duplicate_targets():
+    rejected = {}
+    steps = _plan_renumbering({unit(1): 5, unit(2): 5, unit(3): 6}, {1, 2, 3}, rejected)
+    assert set(rejected) == {unit(1), unit(2)}
+    assert steps == [(unit(3), 3, 6)]
+
+
+def test_plan_rejects_ids_in_use():
+    rejected = {}
+    assert _plan_renumbering({unit(1): 7}, {1, 7}, rejected) == []
+    assert set(rejected) == {unit(1)}
+
+
+def test_plan_rejection_cascades():
+    # 2 -> 9 conflicts with 3 -> 9, so 2 keeps its ID and 1 -> 2 conflicts too
+    rejected = {}
+    assert _plan_renumbering({unit(1): 2, unit(2): 9, unit(3): 9}, {1, 2, 3}, rejected) == []
+    assert set(rejected) == {unit(1), unit(2), unit(3)}
+
+
+def test_plan_unit_already_on_its_id():
+    assert _plan_renumbering({unit(4): 4}, {4}, {}) == []
+
+
+# ---- fleet ----
+
+def test_discover(fleet_of):
+    fleet = fleet_of({"a": [1, 2, 3], "b": [1, 7]})
+    assert sorted(fleet.discover()) == [unit(1, "a"), unit(2, "a"), unit(3, "a"), unit(1, "b"), unit(7, "b")]
+
+
+def test_discover_lossy(fleet_of):
+    devices = list(range(40))
+    fleet = fleet_of({"a": devices}, drop_rate=0.05)
+    assert [found.device for found in fleet.discover(attempts=5)] == devices
+
+
+def test_push(rack, fleet_of):
+    fleet = fleet_of({"a": [1, 2], "b": [1]})
+    routings = {unit(1, "a"): bytes([1] * 17), unit(2, "a"): bytes([2] * 17), unit(1, "b"): bytes([3] * 17)}
+    results = fleet.push(routings)
+    assert all(result.ok for result in results)
+    assert {result.unit for result in results} == set(routings)
+    for target, routing in routings.items():
+        assert bytes(rack.links[target.output].unit(target.device).enabled_outputs) == routing
+
+
+def test_push_missing_unit(fleet_of):
+    fleet = fleet_of({"a": [1]})
+    results = {result.unit: result for result in fleet.push({unit(1): bytes(17), unit(2): bytes(17)})}
+    assert results[unit(1)].ok
+    assert not results[unit(2)].ok
+
+
+def test_assign_ids(rack, fleet_of):
+    fleet = fleet_of({"a": [1, 2], "b": [1]})
+    results = fleet.assign_ids({unit(1, "a"): 10, unit(2, "a"): 11, unit(1, "b"): 12})
+    assert all(result.ok for result in results)
+    assert devices_of(rack, "a") == [10, 11]
+    assert devices_of(rack, "b") == [12]
+
+
+def test_assign_ids_swap(rack, fleet_of):
+    fleet = fleet_of({"a": [1, 2, 3]})
+    unit_1 = rack.links["a"].unit(1)
+    results = fleet.assign_ids({unit(1): 2, unit(2): 1})
+    assert all(result.ok for result in results)
+    assert devices_of(rack, "a") == [1, 2, 3]
+    assert unit_1.device == 2
+
+
+def test_assign_ids_conflict(rack, fleet_of):
+    fleet = fleet_of({"a": [1, 2, 3]})
+    results = {result.unit: result for result in fleet.assign_ids({unit(1): 3, unit(2): 5})}
+    assert not results[unit(1)].ok and "in use" in results[unit(1)].error
+    assert results[unit(2)].ok
+    assert devices_of(rack, "a") == [1, 3, 5]
+
+
+def test_assign_ids_stops_after_a_failure(rack, fleet_of, monkeypatch):
+    fleet = fleet_of({"a": [1, 2]}, retries=0)
+    change_device_id = SysexClient.change_device_id
+
+    def failing_change(client, device, new_device):
+        if device == 2:
+            raise SysexTimeout("no answer")
+        change_device_id(client, device, new_device)
+
+    monkeypatch.setattr(SysexClient, "change_device_id", failing_change)
+    # 1 -> 2 waits for 2 -> 3, which fails: 1 -> 2 must not be sent
+    results = {result.unit: result for result in fleet.assign_ids({unit(1): 2, unit(2): 3})}
+    assert results[unit(2)].error == "no answer"
+    assert "not attempted" in results[unit(1)].error
+    assert devices_of(rack, "a") == [1, 2]
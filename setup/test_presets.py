@@ -0,0 +1,76 @@
+"""PresetLibrary storage: slots, tags, persistence and recall frames."""
+import pytest
+
+from presets import PresetLibrary, HEADER_SIZE, RECORD_SIZE
+from protocol import DEVICE, decode_routing
+
+
+@pytest.fixture
+def library(tmp_path):
+    library = PresetLibrary(str(tmp_path / "presets.m18"))
+    yield library
+    library.close()
+
+
+def routing(value):
+    return bytes([value] * RECORD_SIZE)
+
+
+def test_save_and_get(library):
+    library.save("a", routing(1), tags=["live", "live", "b"])
+    library.save("b", routing(2))
+    assert library.get("a") == routing(1)
+    assert library.get("b") == routing(2)
+    assert library.names() == ["a", "b"]
+    assert library.names(tag="live") == ["a"]
+    assert library.tags("a") == ["b", "live"]
+
+
+def test_overwrite_keeps_the_slot(library):
+    library.save("a", routing(1))
+    library.save("a", routing(3))
+    assert library.get("a") == routing(3)
+    assert len(library) == 1
+
+
+def test_deleted_slot_is_reused(library):
+    for index, name in enumerate("abc"):
+        library.save(name, routing(index))
+    library.delete("b")
+    library.save("d", routing(9))
+    assert library.get("d") == routing(9)
+    assert library.get("a") == routing(0) and library.get("c") == routing(2)
+    with open(library.file_name, "rb") as f:
+        assert len(f.read()) == HEADER_SIZE + 3 * RECORD_SIZE
+
+
+def test_wrong_size(library):
+    with pytest.raises(ValueError):
+        library.save("a", bytes(16))
+
+
+def test_reopen(library):
+    library.save("a", routing(5), tags=["x"])
+    library.close()
+    reopened = PresetLibrary(library.file_name)
+    try:
+        assert reopened.get("a") == routing(5)
+        assert reopened.tags("a") == ["x"]
+    finally:
+        reopened.close()
+
+
+def test_not_a_library(tmp_path):
+    file_name = tmp_path / "other.m18"
+    file_name.write_bytes(b"MThd" + bytes(10))
+    with pytest.raises(ValueError):
+        PresetLibrary(str(file_name))
+
+
+def test_frame_follows_the_preset(library):
+    library.save("a", routing(1))
+    frame = library.frame("a", DEVICE)
+    assert library.frame("a", DEVICE) is frame
+    assert bytes(decode_routing(list(frame.data[4:]))) == routing(1)
+    library.save("a", routing(2))
+    assert bytes(decode_routing(list(library.frame("a", DEVICE).data[4:]))) == routing(2)
@@ -0,0 +1,102 @@
+"""SysexClient against emulated units (in-process loopback ports)."""
+import threading
+
+import pytest
+
+from emulator import EmulatedPort
+from protocol import DEVICE, DEVICE_BROADCAST, SysexTimeout
+from routing_matrix import FIRMWARE_DEFAULT_ROUTING, RT_CHANNEL
+
+ROUTING = bytes(range(1, 18))
+
+
+def drop_replies(monkeypatch, link, count):
+    """Lose the next count replies of the units of link."""
+    reply = link._reply
+    state = {"left": count}
+
+    def lossy_reply(message):
+        if state["left"]:
+            state["left"] -= 1
+            return
+        reply(message)
+
+    monkeypatch.setattr(link, "_reply", lossy_reply)
+
+
+def test_ping(client):
+    client.ping(DEVICE)
+
+
+def test_ping_unknown_device(client):
+    with pytest.raises(SysexTimeout):
+        client.ping(DEVICE + 1)
+
+
+@pytest.mark.parametrize("retries", [0, 1, 3])
+def test_attempts(client, link, retries):
+    with pytest.raises(SysexTimeout):
+        client.request(0x01, device=DEVICE + 1, retries=retries)
+    assert link.received == retries + 1
+
+
+def test_write_and_read(client, link):
+    client.write_routing(ROUTING, DEVICE)
+    assert bytes(link.unit(DEVICE).enabled_outputs) == ROUTING
+    assert bytes(client.read_routing(DEVICE)) == ROUTING
+
+
+def test_partial_write(client, link):
+    client.write_channels({0: 0xFF, RT_CHANNEL: 0x00}, DEVICE)
+    expected = bytearray(FIRMWARE_DEFAULT_ROUTING)
+    expected[0], expected[RT_CHANNEL] = 0xFF, 0x00
+    assert bytes(link.unit(DEVICE).enabled_outputs) == bytes(expected)
+
+
+def test_reply_lost_once(client, link, monkeypatch):
+    drop_replies(monkeypatch, link, 1)
+    assert bytes(client.read_routing(DEVICE)) == FIRMWARE_DEFAULT_ROUTING
+    assert link.received == 2
+
+
+def test_change_device_id(client, link):
+    client.change_device_id(DEVICE, 0x20)
+    assert link.units[0].device == 0x20
+    client.ping(0x20)
+    with pytest.raises(SysexTimeout):
+        client.ping(DEVICE)
+
+
+def test_change_device_id_lost_acknowledge(client, link, monkeypatch):
+    drop_replies(monkeypatch, link, 1)
+    client.change_device_id(DEVICE, 0x20)
+    assert link.units[0].device == 0x20
+    assert link.received == 2                   # the change, then a ping of the new ID: not sent again
+
+
+def test_change_device_id_not_applied(client, link):
+    with pytest.raises(SysexTimeout):
+        client.change_device_id(DEVICE + 1, 0x20)
+    assert link.units[0].device == DEVICE
+
+
+def test_change_device_id_invalid(client):
+    with pytest.raises(ValueError):
+        client.change_device_id(DEVICE, DEVICE_BROADCAST)
+
+
+def test_discover(rack, connect):
+    rack.add("chain", EmulatedPort([0x01, 0x05, 0x09]))
+    assert connect("chain").discover() == [0x01, 0x05, 0x09]
+
+
+def test_request_async_order(client, link):
+    done = []
+    for enabled in range(1, 21):
+        client.request_async(lambda client, enabled=enabled: client.write_routing([enabled] * 17, DEVICE),
+                             done.append, done.append)
+    finished = threading.Event()
+    client.request_async(lambda client: None, lambda result: finished.set(), done.append)
+    assert finished.wait(5)
+    assert done == [None] * 20
+    assert bytes(link.unit(DEVICE).enabled_outputs) == bytes([20] * 17)
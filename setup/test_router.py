@@ -0,0 +1,46 @@
+"""SoftwareRouter dispatch, with in-memory output ports."""
+import pytest
+from mido import Message
+
+from router import CHANNEL_MESSAGE_TYPES, SYSTEM_MESSAGE_TYPES, SoftwareRouter
+from routing_matrix import FIRMWARE_DEFAULT_ROUTING, output_mask
+
+
+class RecordingPort:
+    def __init__(self, name):
+        self.name = name
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def ports():
+    return [RecordingPort(f"out {output + 1}") for output in range(8)]
+
+
+def test_status_bytes():
+    router = SoftwareRouter([])
+    for name in CHANNEL_MESSAGE_TYPES:
+        assert router._status_by_type[name] == Message(name, channel=5).bytes()[0] & 0xF0
+    for name in SYSTEM_MESSAGE_TYPES:
+        assert router._status_by_type[name] >= 0xF0
+
+
+def test_firmware_routing(ports):
+    router = SoftwareRouter(ports, FIRMWARE_DEFAULT_ROUTING)
+    messages = ([Message(name, channel=channel) for name in CHANNEL_MESSAGE_TYPES for channel in range(16)]
+                + [Message(name) for name in SYSTEM_MESSAGE_TYPES])
+    for message in messages:
+        router.on_message(message)
+    router.close()
+
+    for output, port in enumerate(ports):
+        expected = [message for message in messages
+                    if output_mask(message.bytes()[0], FIRMWARE_DEFAULT_ROUTING) & (1 << output)]
+        assert port.messages == expected
+    assert router.unrouted == 8 * len(CHANNEL_MESSAGE_TYPES)       # channels 9 to 16
@@ -0,0 +1,102 @@
+"""RoutingMatrix edits, checked against the 8 x 17 checkbox states."""
+import random
+
+from protocol import NBR_CHANNELS, NBR_OUTPUTS, masks_from_states
+from routing_matrix import FIRMWARE_DEFAULT_ROUTING, RT_CHANNEL, RoutingMatrix, output_mask
+
+
+def random_states(seed):
+    rng = random.Random(seed)
+    return [[rng.random() < 0.5 for _ in range(NBR_CHANNELS)] for _ in range(NBR_OUTPUTS)]
+
+
+def matrix_of(states):
+    matrix = RoutingMatrix()
+    matrix.set_states(states)
+    return matrix
+
+
+def test_states_round_trip():
+    states = random_states(1)
+    matrix = matrix_of(states)
+    assert matrix.to_states() == states
+    assert matrix.masks() == bytes(masks_from_states(states))
+
+
+def test_set_and_get():
+    matrix = RoutingMatrix()
+    matrix.set(3, RT_CHANNEL, True)
+    assert matrix.get(3, RT_CHANNEL)
+    assert matrix.masks()[RT_CHANNEL] == 0x08
+    matrix.set(3, RT_CHANNEL, False)
+    assert matrix.masks() == bytes(NBR_CHANNELS)
+
+
+def test_set_row():
+    states = random_states(2)
+    matrix = matrix_of(states)
+    matrix.set_row(5, True)
+    matrix.set_row(6, False)
+    states[5] = [True] * NBR_CHANNELS
+    states[6] = [False] * NBR_CHANNELS
+    assert matrix.to_states() == states
+
+
+def test_set_column():
+    states = random_states(3)
+    matrix = matrix_of(states)
+    matrix.set_column(4, True)
+    matrix.set_column(RT_CHANNEL, False)
+    for row in states:
+        row[4], row[RT_CHANNEL] = True, False
+    assert matrix.to_states() == states
+
+
+def test_invert():
+    states = random_states(4)
+    matrix = matrix_of(states)
+    matrix.invert()
+    assert matrix.to_states() == [[not state for state in row] for row in states]
+
+
+def test_copy_row():
+    states = random_states(5)
+    for source, destination in ((0, 7), (7, 0), (3, 4), (2, 2)):
+        matrix = matrix_of(states)
+        matrix.copy_row(source, destination)
+        expected = [list(row) for row in states]
+        expected[destination] = list(states[source])
+        assert matrix.to_states() == expected
+
+
+def test_transpose():
+    states = random_states(6)
+    matrix = matrix_of(states)
+    matrix.transpose()
+    result = matrix.to_states()
+    for output in range(NBR_OUTPUTS):
+        for channel in range(NBR_OUTPUTS):
+            assert result[output][channel] == states[channel][output]
+        assert result[output][NBR_OUTPUTS:] == states[output][NBR_OUTPUTS:]
+    matrix.transpose()
+    assert matrix.to_states() == states
+
+
+def test_listeners_and_batch():
+    matrix = RoutingMatrix(FIRMWARE_DEFAULT_ROUTING)
+    calls = []
+    matrix.add_listener(calls.append)
+    matrix.set(0, 0, True)                      # no change
+    assert calls == []
+    matrix.invert()
+    assert calls == [matrix]
+    with matrix.batch():
+        matrix.set_row(0, True)
+        matrix.set_column(1, False)
+    assert calls == [matrix, matrix]
+
+
+def test_output_mask():
+    assert output_mask(0x93, FIRMWARE_DEFAULT_ROUTING) == 0x08
+    assert output_mask(0x9A, FIRMWARE_DEFAULT_ROUTING) == 0x00
+    assert output_mask(0xF8, FIRMWARE_DEFAULT_ROUTING) == 0xFF
@@ -0,0 +1,72 @@
+"""Round-trip tests of the 7-bit SysEx codec, against the historical byte-by-byte implementation."""
+import random
+
+import pytest
+
+import sysex7bit
+from protocol import convert_to_7bit_message, convert_from_7bit_message
+
+
+def reference_pack(byte_message):
+    packed_message = [0] * sysex7bit.packed_size(len(byte_message))
+    carry, carry_idx, packed_idx, carry_cnt = 0x00, 0, 1, 0
+    for byte in byte_message:
+        packed_message[packed_idx] = byte & 0x7F
+        packed_idx += 1
+        carry |= (byte & 0x80) >> carry_cnt + 1
+        carry_cnt += 1
+        if carry_cnt == 7:
+            packed_message[carry_idx] = carry
+            carry, carry_cnt = 0x00, 0
+            carry_idx = packed_idx
+            packed_idx += 1
+    packed_message[carry_idx] = carry
+    return bytes(packed_message)
+
+
+def random_payloads(size, count, seed):
+    rng = random.Random(seed * 1000 + size)
+    return [bytes(rng.randrange(256) for _ in range(size)) for _ in range(count)]
+
+
+@pytest.mark.parametrize("size", [*range(64), 127, 128, 129, 1000])
+def test_round_trip(size):
+    for data in random_payloads(size, 50, seed=1):
+        packed = sysex7bit.pack(data)
+        assert packed == reference_pack(data)
+        assert len(packed) == sysex7bit.packed_size(size)
+        assert all(byte < 0x80 for byte in packed)
+        assert sysex7bit.unpack(packed) == data
+
+
+@pytest.mark.parametrize("size", [0, 1, 7, 8, 17, 63])
+def test_buffer_types(size):
+    for data in random_payloads(size, 10, seed=2):
+        assert sysex7bit.pack(memoryview(bytearray(data))) == sysex7bit.pack(data)
+        assert sysex7bit.pack(list(data)) == sysex7bit.pack(data)
+        assert sysex7bit.unpack(memoryview(sysex7bit.pack(data))) == data
+
+
+@pytest.mark.parametrize("size", [0, 1, 6, 7, 17, 63])
+def test_pack_many(size):
+    bank = random_payloads(size, 20, seed=3)
+    assert sysex7bit.pack_many(bank) == [reference_pack(data) for data in bank]
+
+
+def test_pack_many_mixed_sizes():
+    bank = random_payloads(17, 5, seed=4) + random_payloads(9, 5, seed=4)
+    assert sysex7bit.pack_many(bank) == [reference_pack(data) for data in bank]
+
+
+def test_extreme_values():
+    for data in (bytes(17), b"\xff" * 17, b"\x80" * 14, b"\x7f" * 14):
+        assert sysex7bit.pack(data) == reference_pack(data)
+        assert sysex7bit.unpack(sysex7bit.pack(data)) == data
+
+
+def test_legacy_wrappers():
+    for data in random_payloads(17, 20, seed=5):
+        packed_message = [0] * 20
+        convert_to_7bit_message(data, packed_message)
+        assert bytes(packed_message) == reference_pack(data)
+        assert convert_from_7bit_message(packed_message) == list(data)
@@ -0,0 +1,63 @@
+"""
+Incoming traffic monitor: message rates per MIDI channel (and RT) on the input port.
+
+on_message() is called by the MIDI backend thread for every incoming message
+and only increments a counter in a fixed ring of time slots, so dense clock
+or CC streams cost next to nothing. The ring is only written by that thread;
+readers (the GUI timer) just sum the completed slots, no lock is needed.
+"""
+import time
+
+from protocol import NBR_CHANNELS
+from routing_matrix import RT_CHANNEL
+
+
+class TrafficMonitor:
+    """Per channel (16 + RT) message counters over a ring of time slots."""
+
+    def __init__(self, slots=10, slot_time=0.1):
+        self.slots = slots
+        self.slot_time = slot_time
+        self._counts = [0] * (slots * NBR_CHANNELS)     # slot-major: counts[slot * 17 + channel]
+        self._slot_ids = [-1] * slots                   # absolute slot number held by each ring slot
+        self.totals = [0] * NBR_CHANNELS
+        self.last_seen = [0.0] * NBR_CHANNELS
+
+    def on_message(self, message):
+        """Count a message (called from the MIDI backend thread)."""
+        now = time.monotonic()
+        slot_id = int(now / self.slot_time)
+        slot = slot_id % self.slots
+        base = slot * NBR_CHANNELS
+        if self._slot_ids[slot] != slot_id:
+            # entering a new slot: forget what it counted one ring ago
+            self._counts[base:base + NBR_CHANNELS] = [0] * NBR_CHANNELS
+            self._slot_ids[slot] = slot_id
+
+        channel = getattr(message, "channel", RT_CHANNEL)   # system messages have no channel
+        self._counts[base + channel] += 1
+        self.totals[channel] += 1
+        self.last_seen[channel] = now
+
+    def rates(self):
+        """Messages per second of each channel, over the completed slots of the ring."""
+        current_id = int(time.monotonic() / self.slot_time)
+        rates = [0.0] * NBR_CHANNELS
+        for slot, slot_id in enumerate(self._slot_ids):
+            if current_id - self.slots < slot_id < current_id:
+                base = slot * NBR_CHANNELS
+                for channel, count in enumerate(self._counts[base:base + NBR_CHANNELS]):
+                    rates[channel] += count
+        period = (self.slots - 1) * self.slot_time
+        return [count / period for count in rates]
+
+    def active(self, hold=0.2):
+        """Channels which received something during the last hold seconds."""
+        limit = time.monotonic() - hold
+        return [seen > limit for seen in self.last_seen]
+
+    def reset(self):
+        self._counts = [0] * (self.slots * NBR_CHANNELS)
+        self._slot_ids = [-1] * self.slots
+        self.totals = [0] * NBR_CHANNELS
+        self.last_seen = [0.0] * NBR_CHANNELS